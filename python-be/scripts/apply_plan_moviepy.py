@@ -1,9 +1,11 @@
 ﻿import json
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import time
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 PROJECT_ROOT = REPO_ROOT.parent
@@ -20,6 +22,11 @@ from moviepy import (
 )
 from moviepy.config import FFMPEG_BINARY
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
 try:
     from moviepy import TextClip  # type: ignore[attr-defined]
 except ImportError:  # pragma: no cover - optional dependency
@@ -87,6 +94,13 @@ def clamp_interval(start: float, end: float, duration: float) -> tuple[float, fl
     return start_clamped, end_clamped
 
 
+def action_start_time(action: dict) -> float:
+    try:
+        return float(action.get('start', action.get('time', 0.0)) or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
 def resolve_asset_path(asset: str | None, subdir: str) -> str | None:
     if not asset:
         return None
@@ -115,10 +129,21 @@ def safe_close_clip(clip):
 
 
 
+# Rendered caption bases keyed by (text, style, width): repeated captions
+# reuse one TextClip render instead of forking ImageMagick again.
+_caption_render_cache: dict[tuple[str, str, int], object] = {}
+
+
 def make_caption_clip(text: str, start_time: float, duration: float, style_name: str, base_width: int):
     if TextClip is None:
         print('[SKIP] Caption requires MoviePy TextClip support (ImageMagick).')
         return None
+    cache_key = (text, style_name, base_width)
+    if cache_key in _caption_render_cache:
+        cached = _caption_render_cache[cache_key]
+        if cached is None:
+            return None
+        return _position_caption_clip(cached, start_time, duration, style_name)
     style = CAPTION_STYLES.get(style_name, DEFAULT_CAPTION_STYLE)
     width_ratio = style.get("width_ratio", 0.75)
     width = int(base_width * width_ratio)
@@ -182,6 +207,7 @@ def make_caption_clip(text: str, start_time: float, duration: float, style_name:
 
     if clip is None:
         print(f"[SKIP] Caption render failed: {last_error}")
+        _caption_render_cache[cache_key] = None
         return None
 
 
@@ -189,44 +215,327 @@ def make_caption_clip(text: str, start_time: float, duration: float, style_name:
         clip = clip.margin(**margin_kwargs)
     elif hasattr(clip, 'with_margin'):
         clip = clip.with_margin(**margin_kwargs)
-    clip = (
+    _caption_render_cache[cache_key] = clip
+    return _position_caption_clip(clip, start_time, duration, style_name)
+
+
+def _position_caption_clip(clip, start_time: float, duration: float, style_name: str):
+    style = CAPTION_STYLES.get(style_name, DEFAULT_CAPTION_STYLE)
+    return (
         clip.with_start(start_time)
         .with_duration(duration)
         .with_position(style.get("position", ("center", "bottom")))
         .with_opacity(style.get("opacity", 0.9))
     )
-    return clip
 
 
-if len(sys.argv) < 5:
-    print('Usage: python apply_plan_moviepy.py <input_video> <plan.json> <logo_path or NONE> <output_video>')
-    sys.exit(1)
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
 
-input_video, plan_file, logo_path, output_file = sys.argv[1:5]
 
-print(f'[INFO] Loading video: {input_video}')
-source_clip = VideoFileClip(input_video)
-source_duration = float(source_clip.duration or 0.0)
+def probe_media_duration(path: str) -> float | None:
+    try:
+        result = subprocess.run(
+            [
+                FFPROBE_BINARY, '-v', 'error',
+                '-show_entries', 'format=duration',
+                '-of', 'default=noprint_wrappers=1:nokey=1',
+                path,
+            ],
+            capture_output=True, text=True, check=True,
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
 
-with open(plan_file, 'r', encoding='utf-8') as handle:
-    plan = json.load(handle)
 
-segments = plan.get('segments', [])
+def probe_has_audio(path: str) -> bool:
+    try:
+        result = subprocess.run(
+            [
+                FFPROBE_BINARY, '-v', 'error',
+                '-select_streams', 'a',
+                '-show_entries', 'stream=index',
+                '-of', 'csv=p=0',
+                path,
+            ],
+            capture_output=True, text=True, check=True,
+        )
+        return bool(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+
+def build_audio_filter_chain(plan: dict) -> str:
+    filters_cfg = plan.get('audio', {}).get('filters', {})
+    audio_filters = []
+    if filters_cfg:
+        highpass = filters_cfg.get('highpass_hz')
+        lowpass = filters_cfg.get('lowpass_hz')
+        if isinstance(highpass, (int, float)) and highpass > 0:
+            audio_filters.append(f'highpass=f={highpass}')
+        if isinstance(lowpass, (int, float)) and lowpass > 0:
+            audio_filters.append(f'lowpass=f={lowpass}')
+    return ','.join(audio_filters)
+
+
+def detect_video_encoder() -> str:
+    """Pick the output video codec once per run.
+
+    APPLY_PLAN_VIDEO_CODEC overrides (e.g. hevc_nvenc); otherwise h264_nvenc
+    is used when it actually works here, falling back to libx264."""
+    override = os.environ.get('APPLY_PLAN_VIDEO_CODEC')
+    if override:
+        return override
+    try:
+        result = subprocess.run(
+            [FFMPEG_BINARY, '-hide_banner', '-encoders'],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return 'libx264'
+    if 'h264_nvenc' in result.stdout:
+        # Stock builds list the encoder even without an NVIDIA driver; only
+        # a real (one-frame) encode proves it is usable on this host.
+        try:
+            subprocess.run(
+                [
+                    FFMPEG_BINARY, '-hide_banner', '-v', 'error',
+                    '-f', 'lavfi', '-i', 'color=c=black:s=64x64:d=0.1',
+                    '-frames:v', '1', '-c:v', 'h264_nvenc', '-f', 'null', '-',
+                ],
+                capture_output=True, check=True,
+            )
+            return 'h264_nvenc'
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    return 'libx264'
 
-if segments:
-    print(f'[INFO] Detected {len(segments)} planned segments; trimming source clip.')
-    subclips = []
+
+def collect_segment_spans(segments: list, duration: float) -> list[tuple[float, float]]:
+    spans: list[tuple[float, float]] = []
     for idx, segment in enumerate(segments, start=1):
         raw_start = float(segment['start'])
         raw_end = float(segment['end'])
-        start = clamp_time(raw_start, source_duration)
-        end = clamp_time(raw_end, source_duration)
+        start = clamp_time(raw_start, duration)
+        end = clamp_time(raw_end, duration)
         if end - start <= EPSILON:
             print(f"  - [SKIP] Segment {idx} invalid after clamping ({raw_start:.3f}s -> {raw_end:.3f}s)")
             continue
         print(f'  - Segment {idx}: {start:.3f}s to {end:.3f}s')
-        subclips.append(source_clip.subclipped(start, end))
-    base_clip = concatenate_videoclips(subclips, method='compose') if subclips else source_clip
+        spans.append((start, end))
+    return spans
+
+
+def build_ffmpeg_command(plan: dict, input_video: str, logo_path: str, output_file: str) -> list[str] | None:
+    """Build one ffmpeg filter_complex render for plans this graph can express.
+
+    Segments become trim+concat, the logo becomes a scale2ref+overlay, SFX
+    become adelay+amix, and the audio filters fold into the same pass, so
+    ffmpeg decodes/encodes each frame once with no Python frame loop.
+    Returns None when the plan needs MoviePy-only features (zoom,
+    transition, caption) so the caller can fall back."""
+    sfx_actions = []
+    for action in plan.get('actions', []):
+        if not isinstance(action, dict):
+            continue
+        action_type = (action.get('type') or '').lower()
+        if action_type == 'sfx':
+            sfx_actions.append(action)
+        elif action_type in ('zoom', 'transition', 'caption'):
+            return None
+
+    source_duration = probe_media_duration(input_video)
+    if source_duration is None or source_duration <= 0 or not probe_has_audio(input_video):
+        return None
+
+    spans = collect_segment_spans(plan.get('segments', []), source_duration)
+
+    filters = []
+    if spans:
+        concat_pads = []
+        for idx, (start, end) in enumerate(spans):
+            filters.append(f'[0:v]trim=start={start:.3f}:end={end:.3f},setpts=PTS-STARTPTS[v{idx}]')
+            filters.append(f'[0:a]atrim=start={start:.3f}:end={end:.3f},asetpts=PTS-STARTPTS[a{idx}]')
+            concat_pads.append(f'[v{idx}][a{idx}]')
+        filters.append(''.join(concat_pads) + f'concat=n={len(spans)}:v=1:a=1[vout][abase]')
+        timeline_duration = sum(end - start for start, end in spans)
+    else:
+        filters.append('[0:v]null[vout]')
+        filters.append('[0:a]anull[abase]')
+        timeline_duration = source_duration
+
+    inputs = ['-i', input_video]
+    input_index = 1
+    video_label = '[vout]'
+    if logo_path != 'NONE' and os.path.exists(logo_path):
+        # Mirror the MoviePy layer: logo scaled to 15% of frame width,
+        # pinned to the top-right corner for the whole timeline. In scale2ref
+        # iw/ih are the reference (frame) size and mdar is the main (logo)
+        # aspect, so this keeps the logo's own proportions.
+        print(f'[LOGO] Adding logo: {logo_path}')
+        inputs.extend(['-i', logo_path])
+        filters.append(
+            f'[{input_index}:v]{video_label}scale2ref=w=trunc(iw*0.15):h=trunc(ow/mdar)[logo][vbase]'
+        )
+        filters.append('[vbase][logo]overlay=x=W-w:y=0[vlogo]')
+        video_label = '[vlogo]'
+        input_index += 1
+
+    sfx_labels = []
+    last_sfx: dict[str, float] = {}
+    for action in sfx_actions:
+        asset = resolve_asset_path(action.get('asset') or action.get('name'), 'sfx')
+        if not asset or not os.path.exists(asset):
+            print(f"[SKIP] Missing SFX asset: {action.get('asset') or action.get('name')}")
+            continue
+        raw_start = float(action.get('time', action.get('start', 0.0)))
+        if raw_start >= timeline_duration and timeline_duration > 0:
+            print(f'[SKIP] SFX {asset} at {raw_start:.3f}s beyond timeline ({timeline_duration:.3f}s)')
+            continue
+        start_time = clamp_time(raw_start, timeline_duration)
+        cooldown_key = action.get('group') or Path(asset).stem
+        if start_time - last_sfx.get(cooldown_key, -1e9) < 0.5:
+            continue
+        last_sfx[cooldown_key] = start_time
+        print(f'[SFX] {asset} at {start_time:.3f}s')
+        delay_ms = int(start_time * 1000)
+        inputs.extend(['-i', asset])
+        filters.append(f'[{input_index}:a]adelay={delay_ms}:all=1[s{input_index}]')
+        sfx_labels.append(f'[s{input_index}]')
+        input_index += 1
+
+    audio_label = '[abase]'
+    if sfx_labels:
+        filters.append(
+            '[abase]' + ''.join(sfx_labels)
+            + f'amix=inputs={len(sfx_labels) + 1}:duration=first:normalize=0[amixed]'
+        )
+        audio_label = '[amixed]'
+
+    filter_chain = build_audio_filter_chain(plan)
+    if filter_chain:
+        filters.append(f'{audio_label}{filter_chain}[aout]')
+        audio_label = '[aout]'
+
+    return [
+        FFMPEG_BINARY, '-y', *inputs,
+        '-filter_complex', ';'.join(filters),
+        '-map', video_label, '-map', audio_label,
+        '-c:v', VIDEO_CODEC, '-c:a', 'aac',
+        output_file,
+    ]
+
+
+def try_stream_copy_render(plan: dict, input_video: str, logo_path: str, output_file: str) -> bool:
+    """Cut and concatenate trim-only plans without re-encoding.
+
+    Applies when there is nothing to composite: no logo, no actions, no
+    audio filters. Cuts are keyframe-aligned (a -c copy limitation), which
+    is why this path only runs under the opt-in ffmpeg engine."""
+    if logo_path != 'NONE' and os.path.exists(logo_path):
+        return False
+    if plan.get('actions') or build_audio_filter_chain(plan):
+        return False
+    segments = plan.get('segments', [])
+    if not segments:
+        return False
+    source_duration = probe_media_duration(input_video)
+    if not source_duration or source_duration <= 0:
+        return False
+    spans = collect_segment_spans(segments, source_duration)
+    if not spans:
+        return False
+
+    tmp_dir = tempfile.mkdtemp(prefix='plan_copy_')
+    try:
+        list_path = os.path.join(tmp_dir, 'concat.txt')
+        with open(list_path, 'w', encoding='utf-8') as handle:
+            for idx, (start, end) in enumerate(spans):
+                part = os.path.join(tmp_dir, f'part_{idx:03d}.mp4')
+                subprocess.run(
+                    [
+                        FFMPEG_BINARY, '-y',
+                        '-ss', f'{start:.3f}', '-to', f'{end:.3f}',
+                        '-i', input_video,
+                        '-c', 'copy', part,
+                    ],
+                    check=True, capture_output=True,
+                )
+                handle.write(f"file '{part}'\n")
+        subprocess.run(
+            [
+                FFMPEG_BINARY, '-y',
+                '-f', 'concat', '-safe', '0',
+                '-i', list_path,
+                '-c', 'copy', output_file,
+            ],
+            check=True, capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as exc:
+        print(f'[WARN] Stream-copy fast path failed ({exc}); falling back to re-encode')
+        return False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return True
+
+
+VIDEO_CODEC = detect_video_encoder()
+
+
+if len(sys.argv) < 5:
+    print('Usage: python apply_plan_moviepy.py <input_video> <plan.json> <logo_path or NONE> <output_video>')
+    sys.exit(1)
+
+input_video, plan_file, logo_path, output_file = sys.argv[1:5]
+
+if orjson is not None:
+    plan = orjson.loads(Path(plan_file).read_bytes())
+else:
+    with open(plan_file, 'r', encoding='utf-8') as handle:
+        plan = json.load(handle)
+
+if (os.environ.get('APPLY_PLAN_ENGINE') or 'moviepy').lower() == 'ffmpeg':
+    if try_stream_copy_render(plan, input_video, logo_path, output_file):
+        print('[EXPORT] Trim-only plan rendered via stream copy (no re-encode)')
+        print('[DONE] Finished rendering.')
+        sys.exit(0)
+    ffmpeg_cmd = build_ffmpeg_command(plan, input_video, logo_path, output_file)
+    if ffmpeg_cmd is None:
+        print('[WARN] Plan needs MoviePy-only features; falling back to MoviePy engine')
+    else:
+        print('[EXPORT] Rendering with a single FFmpeg filter graph pass')
+        subprocess.run(ffmpeg_cmd, check=True)
+        print('[DONE] Finished rendering.')
+        sys.exit(0)
+
+segments = plan.get('segments', [])
+
+# Probe the duration up front so segment validation happens before MoviePy
+# allocates frame readers — a plan with no usable segments fails fast.
+source_duration = probe_media_duration(input_video) or 0.0
+spans: list[tuple[float, float]] | None = None
+if segments and source_duration > 0:
+    print(f'[INFO] Detected {len(segments)} planned segments; trimming source clip.')
+    spans = collect_segment_spans(segments, source_duration)
+
+print(f'[INFO] Loading video: {input_video}')
+source_clip = VideoFileClip(input_video)
+if source_duration <= 0:
+    source_duration = float(source_clip.duration or 0.0)
+
+if segments:
+    if spans is None:
+        # ffprobe unavailable; validate against the clip's own duration.
+        print(f'[INFO] Detected {len(segments)} planned segments; trimming source clip.')
+        spans = collect_segment_spans(segments, source_duration)
+    subclips = [source_clip.subclipped(start, end) for start, end in spans]
+    if len(subclips) == 1:
+        # One segment needs no concat pipeline; use the subclip directly.
+        base_clip = subclips[0]
+    elif subclips:
+        base_clip = concatenate_videoclips(subclips, method='compose')
+    else:
+        base_clip = source_clip
 else:
     print('[WARN] Plan provided no segments; using full source clip.')
     base_clip = source_clip
@@ -250,14 +559,52 @@ last_zoom_time = -1e9
 zoom_count = 0
 last_sfx_time: dict[str, float] = {}
 
-for action in plan.get('actions', []):
-    if not isinstance(action, dict):
-        continue
+# Apply actions in chronological order so the zoom-gap and SFX cooldown gates
+# see starts monotonically regardless of how the plan listed them.
+plan_actions = sorted(
+    (action for action in plan.get('actions', []) if isinstance(action, dict)),
+    key=action_start_time,
+)
+
+# Preload unique action assets in parallel: each open spawns an ffmpeg probe,
+# which is I/O-bound and releases the GIL, so threads overlap the latency.
+preload_audio: set[str] = set()
+preload_video: set[str] = set()
+for action in plan_actions:
+    action_type = (action.get('type') or '').lower()
+    if action_type == 'sfx':
+        asset = resolve_asset_path(action.get('asset') or action.get('name'), 'sfx')
+        if asset and os.path.exists(asset):
+            preload_audio.add(asset)
+    elif action_type == 'transition':
+        asset = resolve_asset_path(action.get('asset'), 'transition')
+        if asset and os.path.exists(asset):
+            preload_video.add(asset)
+
+audio_clip_cache: dict[str, AudioFileClip] = {}
+video_clip_cache: dict[str, VideoFileClip] = {}
+if preload_audio or preload_video:
+    print(f'[INFO] Preloading {len(preload_audio) + len(preload_video)} action assets')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        audio_futures = {asset: executor.submit(AudioFileClip, asset) for asset in preload_audio}
+        video_futures = {asset: executor.submit(VideoFileClip, asset) for asset in preload_video}
+        for asset, future in audio_futures.items():
+            try:
+                audio_clip_cache[asset] = future.result()
+            except Exception as exc:  # pragma: no cover - depends on media files
+                print(f'[WARN] Failed to preload SFX {asset}: {exc}')
+        for asset, future in video_futures.items():
+            try:
+                video_clip_cache[asset] = future.result()
+            except Exception as exc:  # pragma: no cover - depends on media files
+                print(f'[WARN] Failed to preload transition {asset}: {exc}')
+
+for action in plan_actions:
     action_type = (action.get('type') or '').lower()
 
     if action_type == 'sfx':
         asset = resolve_asset_path(action.get('asset') or action.get('name'), 'sfx')
-        if not asset or not os.path.exists(asset):
+        if not asset or asset not in audio_clip_cache:
             print(f"[SKIP] Missing SFX asset: {action.get('asset') or action.get('name')}")
             continue
         raw_start = float(action.get('time', action.get('start', 0.0)))
@@ -269,7 +616,7 @@ for action in plan.get('actions', []):
         if start_time - last_sfx_time.get(cooldown_key, -1e9) < 0.5:
             continue
         print(f'[SFX] {asset} at {start_time:.3f}s')
-        layers_a.append(AudioFileClip(asset).with_start(start_time))
+        layers_a.append(audio_clip_cache[asset].with_start(start_time))
         last_sfx_time[cooldown_key] = start_time
 
     elif action_type == 'zoom':
@@ -309,10 +656,10 @@ for action in plan.get('actions', []):
         duration = min(raw_duration, available)
         asset = resolve_asset_path(action.get('asset'), 'transition')
         style_name = (action.get('style') or '').lower()
-        if asset and os.path.exists(asset):
+        if asset and asset in video_clip_cache:
             print(f'[TRANSITION] {asset} at {start_time:.3f}s for {duration:.3f}s')
             transition_clip = (
-                VideoFileClip(asset)
+                video_clip_cache[asset]
                 .with_start(start_time)
                 .resized(width=base_clip.w)
                 .with_duration(duration)
@@ -355,37 +702,32 @@ composite = CompositeVideoClip(layers_v, size=(base_clip.w, base_clip.h))
 if layers_a:
     composite = composite.with_audio(CompositeAudioClip(layers_a))
 
-filters_cfg = plan.get('audio', {}).get('filters', {})
-audio_filters = []
-if filters_cfg:
-    highpass = filters_cfg.get('highpass_hz')
-    lowpass = filters_cfg.get('lowpass_hz')
-    if isinstance(highpass, (int, float)) and highpass > 0:
-        audio_filters.append(f'highpass=f={highpass}')
-    if isinstance(lowpass, (int, float)) and lowpass > 0:
-        audio_filters.append(f'lowpass=f={lowpass}')
-
-needs_audio_filters = bool(audio_filters)
-audio_filter_chain = ','.join(audio_filters)
+audio_filter_chain = build_audio_filter_chain(plan)
 
 output_path = Path(output_file)
-export_path = output_path
-if needs_audio_filters:
-    export_path = output_path.with_name(output_path.stem + '_pre_filter' + output_path.suffix)
-    print(f'[AUDIO] Will apply filters after render: {audio_filter_chain}')
-
-print(f'[EXPORT] Writing final video to: {export_path}')
+extra_ffmpeg_params = []
+if audio_filter_chain:
+    # Fold the filters into the encode itself: no _pre_filter temp file,
+    # no second ffmpeg pass re-reading the full output. MoviePy muxes its
+    # pre-encoded audio with -acodec copy, which ffmpeg rejects alongside
+    # -af; the trailing -c:a overrides the copy so the filters can run.
+    print(f'[AUDIO] Applying filters during render: {audio_filter_chain}')
+    extra_ffmpeg_params = ['-c:a', 'aac', '-af', audio_filter_chain]
+
+print(f'[EXPORT] Writing final video to: {output_path} (codec {VIDEO_CODEC})')
 composite.write_videofile(
-    str(export_path),
+    str(output_path),
     fps=base_clip.fps or 30,
-    codec='libx264',
+    codec=VIDEO_CODEC,
     audio_codec='aac',
     audio=True,
+    ffmpeg_params=extra_ffmpeg_params or None,
 )
 
-# release resources before FFmpeg step
+# release resources
 seen_ids = set()
-for clip in layers_v + [base_clip, composite]:
+caption_bases = [clip for clip in _caption_render_cache.values() if clip is not None]
+for clip in layers_v + list(video_clip_cache.values()) + caption_bases + [base_clip, composite]:
     clip_id = id(clip)
     if clip_id in seen_ids:
         continue
@@ -393,7 +735,7 @@ for clip in layers_v + [base_clip, composite]:
     safe_close_clip(clip)
 
 seen_ids.clear()
-for audio_layer in layers_a:
+for audio_layer in layers_a + list(audio_clip_cache.values()):
     clip_id = id(audio_layer)
     if clip_id in seen_ids:
         continue
@@ -402,34 +744,6 @@ for audio_layer in layers_a:
 
 safe_close_clip(source_clip)
 
-def remove_with_retry(path: Path, attempts: int = 3, delay: float = 0.3) -> None:
-    for attempt in range(attempts):
-        try:
-            path.unlink()
-            return
-        except PermissionError:
-            if attempt == attempts - 1:
-                print(f'[WARN] Could not remove temporary file: {path}')
-            else:
-                time.sleep(delay)
-
-if needs_audio_filters:
-    ffmpeg_cmd = [
-        FFMPEG_BINARY,
-        '-y',
-        '-i',
-        str(export_path),
-        '-c:v',
-        'copy',
-        '-af',
-        audio_filter_chain,
-        str(output_path),
-    ]
-    print(f'[AUDIO] Post-processing audio with FFmpeg filters: {audio_filter_chain}')
-    subprocess.run(ffmpeg_cmd, check=True)
-    remove_with_retry(export_path)
-    print(f'[AUDIO] Filtered audio written to {output_path}')
-
 print('[DONE] Finished rendering.')
 
 
@@ -1,38 +1,64 @@
+import functools
+import itertools
 import json
-import math
 import os
 import re
 import sys
 import unicodedata
-from collections import defaultdict
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence
 
 from dotenv import load_dotenv
 
+try:
+    import ahocorasick  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    ahocorasick = None
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
 WORD_RE = re.compile(r"[\w']+", re.UNICODE)
 
-HIGHLIGHT_ANIMATIONS = ["zoom", "fade", "slide", "typewriter"]
-HIGHLIGHT_VARIANTS = ["blurred", "callout", "brand", "cutaway", "typewriter"]
-HIGHLIGHT_POSITIONS = ["center", "bottom", "top"]
-HIGHLIGHT_TYPES = ["noteBox", "typewriter", "sectionTitle"]
+_NEG_INF = float("-inf")
+
+HIGHLIGHT_ANIMATIONS = ("zoom", "fade", "slide", "typewriter")
+HIGHLIGHT_VARIANTS = ("blurred", "callout", "brand", "cutaway", "typewriter")
+HIGHLIGHT_POSITIONS = ("center", "bottom", "top")
+HIGHLIGHT_TYPES = ("noteBox", "typewriter", "sectionTitle")
 
+_N_ANIMATIONS = len(HIGHLIGHT_ANIMATIONS)
+_N_VARIANTS = len(HIGHLIGHT_VARIANTS)
+_N_POSITIONS = len(HIGHLIGHT_POSITIONS)
+_N_TYPES = len(HIGHLIGHT_TYPES)
 
-def cycle_choice(options: List[str], index: int) -> str:
+
+def cycle_choice(options: Sequence[str], index: int) -> str:
     if not options:
         return ""
     return options[index % len(options)]
 
 
+_WS_RE = re.compile(r"\s+")
+
+
 def collapse_text(text: str, max_length: int = 90) -> str:
-    collapsed = " ".join(text.split())
+    collapsed = _WS_RE.sub(" ", text).strip()
     if len(collapsed) <= max_length:
         return collapsed
-    truncated = collapsed[: max_length - 1].rstrip()
-    last_space = truncated.rfind(" ")
-    if last_space > 40:
-        truncated = truncated[:last_space]
-    return f"{truncated}…"
+    # collapsed has single spaces only, so at most one trailing space to trim.
+    cut = max_length - 1
+    if collapsed[cut - 1] == " ":
+        cut -= 1
+    last_space = collapsed.rfind(" ", 41, cut)
+    if last_space != -1:
+        cut = last_space
+    return f"{collapsed[:cut]}…"
 
 
 def ensure_list(value: Optional[Iterable]) -> List[str]:
@@ -51,18 +77,89 @@ def ensure_list(value: Optional[Iterable]) -> List[str]:
     return []
 
 
+# Combining marks below U+3000 cover every script this pipeline sees after NFD
+# (Latin, Vietnamese, Cyrillic, ...); higher planes fall back to the slow path.
+_COMBINING_TABLE = {
+    codepoint: None
+    for codepoint in range(0x3000)
+    if unicodedata.category(chr(codepoint)) == "Mn"
+}
+_HIGH_PLANE_RE = re.compile("[\u3000-\U0010ffff]")
+
+
+def _build_norm_table() -> Dict[int, str]:
+    """Map Latin/Vietnamese codepoints straight to their lowercased, stripped
+    form, mirroring exactly what lower() + NFD + combining-mark filter emit.
+
+    Per-codepoint lowering is safe here: the covered ranges have no
+    context-dependent case mappings (final sigma lives outside them)."""
+    table: Dict[int, str] = {}
+    for codepoint in (*range(0x0250), *range(0x1E00, 0x1F00)):
+        char = chr(codepoint)
+        folded = unicodedata.normalize("NFD", char.lower()).translate(_COMBINING_TABLE)
+        if folded != char:
+            table[codepoint] = folded
+    return table
+
+
+_NORM_TABLE = _build_norm_table()
+
+
+@functools.lru_cache(maxsize=8192)
 def normalize(text: str) -> str:
-    """Lowercase and strip accents so keyword matching is more tolerant."""
-    lowered = text.lower()
-    decomposed = unicodedata.normalize("NFD", lowered)
-    without_accents = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
-    return unicodedata.normalize("NFC", without_accents)
+    """Lowercase and strip accents so keyword matching is more tolerant.
+
+    Pure function; transcripts repeat short phrases often enough that the
+    LRU cache pays for itself on the entry path.
+    """
+    if text.isascii():
+        return text.lower()
+    # One combined case-fold + accent-strip translate pass resolves typical
+    # Vietnamese/Latin text; the NFD walk below only runs for other scripts.
+    translated = text.translate(_NORM_TABLE)
+    if translated.isascii():
+        return translated
+    lowered = translated.lower()
+    stripped = unicodedata.normalize("NFD", lowered).translate(_COMBINING_TABLE)
+    if _HIGH_PLANE_RE.search(stripped):
+        stripped = "".join(ch for ch in stripped if unicodedata.category(ch) != "Mn")
+    # NFC recomposition is skipped on purpose: every compared string passes
+    # through this same function, so decomposed output matches itself.
+    return stripped
+
+
+_TS_RE = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)")
 
 
 def hms_to_seconds(timestamp: str) -> float:
-    hours, minutes, remainder = timestamp.split(":")
-    seconds, millis = remainder.split(",")
-    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000.0
+    # SRT timestamps are fixed-width HH:MM:SS,mmm; slice directly and keep a
+    # regex fallback for producers that deviate from that layout.
+    try:
+        return (
+            int(timestamp[0:2]) * 3600
+            + int(timestamp[3:5]) * 60
+            + int(timestamp[6:8])
+            + int(timestamp[9:12]) * 0.001
+        )
+    except ValueError:
+        match = _TS_RE.match(timestamp)
+        if not match:
+            raise
+        hours, minutes, seconds, millis = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000.0
+
+
+def _compile_term_alternation(terms: List[str], match_type: str) -> Optional[re.Pattern]:
+    """Combine plain-text terms into one compiled pattern so a single C-level
+    search replaces N Python-level substring scans."""
+    if not terms:
+        return None
+    escaped = "|".join(re.escape(term) for term in terms)
+    if match_type == "startswith":
+        return re.compile(r"^(?:" + escaped + r")")
+    if match_type == "endswith":
+        return re.compile(r"(?:" + escaped + r")$")
+    return re.compile(escaped)
 
 
 def normalize_keyword_sets(rule: Dict) -> Dict[str, List]:
@@ -91,12 +188,47 @@ def normalize_keyword_sets(rule: Dict) -> Dict[str, List]:
                 except re.error as exc:
                     print(f"[WARN] Skipping invalid regex '{pattern}': {exc}")
             normalized[key] = patterns
+        # any/none only need a single hit, so fold multiple patterns into one
+        # alternation and pay one search instead of N. all-sets must stay
+        # individual searches.
+        for key in ("any", "none"):
+            patterns = normalized[key]
+            if len(patterns) > 1:
+                normalized[f"_{key}_combined"] = re.compile(
+                    "|".join(f"(?:{pattern.pattern})" for pattern in patterns),
+                    re.IGNORECASE | re.UNICODE,
+                )
+            elif patterns:
+                normalized[f"_{key}_combined"] = patterns[0]
     else:
         for key in ("any", "all", "none"):
-            normalized[key] = [normalize(term) for term in ensure_list(keyword_dict.get(key)) if term]
+            normalized[key] = [sys.intern(normalize(term)) for term in ensure_list(keyword_dict.get(key)) if term]
+        if match_type in ("contains", "startswith", "endswith"):
+            normalized["_any_re"] = _compile_term_alternation(normalized["any"], match_type)
+            normalized["_all_res"] = [
+                _compile_term_alternation([term], match_type) for term in normalized["all"]
+            ]
+            normalized["_none_re"] = _compile_term_alternation(normalized["none"], match_type)
+        elif match_type == "token":
+            # Frozensets let token matching run as C-level set intersections.
+            normalized["_any_set"] = frozenset(normalized["any"])
+            normalized["_all_set"] = frozenset(normalized["all"])
+            normalized["_none_set"] = frozenset(normalized["none"])
     return normalized
 
 
+# Fallback cooldown keys for anonymous rules; ints hash faster than the
+# str(id(...)) strings they replace and never collide with authored names.
+_RULE_SEQ = itertools.count()
+
+
+def _coerce_float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
 def normalize_action_rule(rule: Dict, defaults: Dict, *, rule_type: str) -> Dict:
     rule_copy = dict(rule)
     rule_copy.setdefault("name", rule_copy.get("asset") or f"{rule_type}_rule")
@@ -105,16 +237,31 @@ def normalize_action_rule(rule: Dict, defaults: Dict, *, rule_type: str) -> Dict
     rule_copy["_match_type"] = (rule_copy.get("match_type") or "contains").lower()
     rule_copy["_keywords"] = normalize_keyword_sets(rule_copy)
 
+    # Resolve the scope string into booleans once so the per-entry matchers
+    # avoid rebuilding membership sets for every candidate rule.
+    scope = (rule_copy.get("scope") or "entry").lower()
+    wide = scope in ("both", "either")
+    rule_copy["_scope_both"] = scope == "both"
+    rule_copy["_scope_either"] = scope == "either"
+    rule_copy["_scope_entry"] = wide or scope == "entry"
+    rule_copy["_scope_segment"] = wide or scope == "segment"
+    rule_copy["_scope_previous"] = wide or scope == "previous"
+    rule_copy["_scope_next"] = wide or scope == "next"
+
     if rule_type == "sfx":
         rule_copy.setdefault("cooldown", defaults.get("sfx_cooldown", 8.0))
         rule_copy.setdefault("offset", 0.0)
         cooldown_key = rule_copy.get("cooldown_group") or rule_copy.get("asset") or rule_copy.get("name")
         rule_copy["_cooldown_key"] = cooldown_key
+        rule_copy["_offset_f"] = _coerce_float(rule_copy.get("offset"), 0.0)
+        rule_copy["_cooldown_f"] = _coerce_float(rule_copy.get("cooldown"), 0.0)
     elif rule_type == "zoom":
         rule_copy.setdefault("cooldown", defaults.get("zoom_cooldown", 6.0))
         rule_copy.setdefault("min_duration", 1.0)
         rule_copy.setdefault("scale", defaults.get("zoom_scale", 1.1))
-        rule_copy["_cooldown_key"] = rule_copy.get("cooldown_group") or rule_copy.get("name") or str(id(rule_copy))
+        rule_copy["_cooldown_key"] = rule_copy.get("cooldown_group") or rule_copy.get("name") or next(_RULE_SEQ)
+        rule_copy["_offset_f"] = _coerce_float(rule_copy.get("offset"), 0.0)
+        rule_copy["_cooldown_f"] = _coerce_float(rule_copy.get("cooldown"), 0.0)
     elif rule_type == "transition":
         # Transitions use additional timing fields but still leverage keyword matching utilities.
         rule_copy.setdefault("offset", 0.0)
@@ -142,18 +289,47 @@ def normalize_action_rule(rule: Dict, defaults: Dict, *, rule_type: str) -> Dict
         rule_copy["max_gap_seconds"] = max_gap
         rule_copy.setdefault("scope", "either")
 
+        asset_lower = (rule_copy.get("asset") or "").lower()
+        rule_copy["_asset_is_slide"] = "slide" in asset_lower
+        rule_copy["_direction_from_asset"] = next(
+            (candidate for candidate in ("left", "right", "up", "down") if candidate in asset_lower),
+            None,
+        )
+
     return rule_copy
 
 
 def load_mapping(mapping_path: Path) -> dict:
-    with mapping_path.open("r", encoding="utf-8") as handle:
-        mapping_raw = json.load(handle)
+    if orjson is not None:
+        mapping_raw = orjson.loads(mapping_path.read_bytes())
+    else:
+        with mapping_path.open("r", encoding="utf-8") as handle:
+            mapping_raw = json.load(handle)
 
     filler_cfg = dict(mapping_raw.get("filler_detection", {}))
     filler_cfg.setdefault("phrases", mapping_raw.get("filler_phrases", []))
     filler_cfg.setdefault("ratio_threshold", mapping_raw.get("filler_ratio_threshold", 0.6))
     filler_cfg.setdefault("min_duration", mapping_raw.get("min_segment_duration", 1.0))
-    filler_cfg["phrases"] = [normalize(phrase) for phrase in ensure_list(filler_cfg.get("phrases"))]
+    filler_cfg["phrases"] = [sys.intern(normalize(phrase)) for phrase in ensure_list(filler_cfg.get("phrases"))]
+    filler_cfg["_automaton"] = build_filler_automaton(filler_cfg["phrases"])
+    # Pre-split for the no-automaton fallback: single words hit the token
+    # counts directly, multi-word phrases fold into one boundary-guarded
+    # alternation so a single C-level scan replaces per-phrase substring scans.
+    single_phrases = set()
+    multi_phrases = []
+    for phrase in filler_cfg["phrases"]:
+        if " " in phrase:
+            multi_phrases.append(phrase)
+        else:
+            single_phrases.add(phrase)
+    filler_cfg["_single_phrases"] = single_phrases
+    filler_cfg["_multi_re"] = (
+        re.compile(
+            r"(?<![\w'])(?:" + "|".join(re.escape(phrase) for phrase in multi_phrases) + r")(?![\w'])"
+        )
+        if multi_phrases
+        else None
+    )
 
     segment_cfg = dict(mapping_raw.get("segmenting", {}))
     segment_cfg.setdefault("merge_gap_seconds", mapping_raw.get("merge_gap_seconds", 0.5))
@@ -173,6 +349,12 @@ def load_mapping(mapping_path: Path) -> dict:
     transition_default.setdefault("gap_threshold", transition_default.get("gap_threshold", 1.0))
     transition_default.setdefault("duration", transition_default.get("duration", 0.5))
     transition_default.setdefault("offset", transition_default.get("offset", 0.0))
+    default_asset_lower = (transition_default.get("asset") or "").lower()
+    transition_default["_asset_is_slide"] = "slide" in default_asset_lower
+    transition_default["_direction_from_asset"] = next(
+        (candidate for candidate in ("left", "right", "up", "down") if candidate in default_asset_lower),
+        None,
+    )
     transition_cfg["default"] = transition_default
     defaults_cfg.setdefault("transition_duration", transition_default.get("duration", 0.5))
     defaults_cfg.setdefault("transition_gap_threshold", transition_default.get("gap_threshold", 1.0))
@@ -197,6 +379,20 @@ def load_mapping(mapping_path: Path) -> dict:
         if isinstance(rule, dict)
     ]
 
+    # Densify cooldown keys to small ints so the runtime cooldown store can be
+    # a flat list instead of a string-keyed dict.
+    cooldown_ids: Dict[str, int] = {}
+    for rule in (*normalized_sfx, *normalized_zoom):
+        key = rule["_cooldown_key"]
+        rule["_cooldown_id"] = cooldown_ids.setdefault(key, len(cooldown_ids))
+
+    sfx_postings, sfx_universal = build_rule_candidate_index(normalized_sfx)
+
+    needs_raw_text = any(
+        rule.get("_match_type") == "regex"
+        for rule in transition_cfg["rules"] + normalized_sfx + normalized_zoom
+    )
+
     audio_cfg = dict(mapping_raw.get("audio", {}))
     if "filters" not in audio_cfg:
         filters = mapping_raw.get("noise_reduction", {})
@@ -207,51 +403,104 @@ def load_mapping(mapping_path: Path) -> dict:
         "segmenting": segment_cfg,
         "defaults": defaults_cfg,
         "transitions": transition_cfg,
-        "actions": {"sfx": normalized_sfx, "zoom": normalized_zoom},
+        "actions": {
+            "sfx": normalized_sfx,
+            "zoom": normalized_zoom,
+            "sfx_postings": sfx_postings,
+            "sfx_universal": sfx_universal,
+            "sfx_token_union": frozenset(sfx_postings),
+            "cooldown_slots": len(cooldown_ids),
+        },
         "audio": audio_cfg,
+        "needs_raw_text": needs_raw_text,
         "raw": mapping_raw,
     }
 
 
-def compute_filler_ratio(tokens, text, filler_phrases) -> float:
+def build_filler_automaton(phrases):
+    """Compile filler phrases into an Aho-Corasick automaton when available."""
+    if ahocorasick is None or not phrases:
+        return None
+    automaton = ahocorasick.Automaton()
+    for phrase in phrases:
+        automaton.add_word(phrase, (len(phrase), len(phrase.split())))
+    automaton.make_automaton()
+    return automaton
+
+
+def _is_word_boundary(text: str, index: int) -> bool:
+    if index < 0 or index >= len(text):
+        return True
+    ch = text[index]
+    return not (ch.isalnum() or ch == "_" or ch == "'")
+
+
+def build_rule_candidate_index(rules: List[Dict]):
+    """Invert token-scope any-terms into a term -> rule-indices map.
+
+    Only rules that cannot fire without the entry containing an indexed term
+    can be pre-filtered safely: contains/regex terms may hit inside a token,
+    and "segment"/"either" scopes can match on the segment context even when
+    the current entry lacks the term, so all of those stay on the universal
+    list and are evaluated for every entry.
+    """
+    postings: Dict[str, List[int]] = defaultdict(list)
+    universal: List[int] = []
+    for index, rule in enumerate(rules):
+        any_terms = rule.get("_keywords", {}).get("any")
+        scope = (rule.get("scope") or "entry").lower()
+        if rule.get("_match_type") == "token" and any_terms and scope in ("entry", "both"):
+            for term in any_terms:
+                postings[term].append(index)
+        else:
+            universal.append(index)
+    return dict(postings), universal
+
+
+def compute_filler_ratio(tokens, text, filler_cfg) -> float:
     if not tokens:
         return 1.0
 
     total = len(tokens)
     filler_hits = 0
 
-    token_counts = defaultdict(int)
-    for token in tokens:
-        token_counts[token] += 1
-
-    for phrase in filler_phrases:
-        if " " in phrase:
-            if phrase in text:
-                filler_hits += len(phrase.split())
-        else:
-            filler_hits += token_counts.get(phrase, 0)
+    automaton = filler_cfg.get("_automaton")
+    if automaton is not None:
+        # Single linear pass over the text; boundary checks keep parity with
+        # token-level matching so "um" does not fire inside "umbrella".
+        for end_index, (length, word_count) in automaton.iter(text):
+            start_index = end_index - length + 1
+            if _is_word_boundary(text, start_index - 1) and _is_word_boundary(text, end_index + 1):
+                filler_hits += word_count
+        return min(1.0, filler_hits / total)
+
+    token_counts = Counter(tokens)
+    single_phrases = filler_cfg.get("_single_phrases")
+    if single_phrases:
+        filler_hits += sum(token_counts[phrase] for phrase in single_phrases & token_counts.keys())
+    multi_re = filler_cfg.get("_multi_re")
+    if multi_re is not None:
+        filler_hits += sum(len(match.group(0).split()) for match in multi_re.finditer(text))
 
     return min(1.0, filler_hits / total) if total else 1.0
 
 
 def match_regex_sets(text: str, keyword_sets: Dict[str, List[re.Pattern]]) -> bool:
-    any_patterns = keyword_sets.get("any", [])
-    all_patterns = keyword_sets.get("all", [])
-    none_patterns = keyword_sets.get("none", [])
-
-    if not any_patterns and not all_patterns and not none_patterns:
-        return True
-
-    if any_patterns and not any(pattern.search(text) for pattern in any_patterns):
+    # normalize_keyword_sets folds any/none patterns into single alternations,
+    # so each gate below is at most one C-level search.
+    any_combined = keyword_sets.get("_any_combined")
+    if any_combined is not None and not any_combined.search(text):
         return False
+    all_patterns = keyword_sets.get("all", [])
     if all_patterns and not all(pattern.search(text) for pattern in all_patterns):
         return False
-    if none_patterns and any(pattern.search(text) for pattern in none_patterns):
+    none_combined = keyword_sets.get("_none_combined")
+    if none_combined is not None and none_combined.search(text):
         return False
     return True
 
 
-def match_token_sets(tokens: List[str], keyword_sets: Dict[str, List[str]]) -> bool:
+def match_token_sets(tokens: Iterable[str], keyword_sets: Dict[str, List[str]]) -> bool:
     any_terms = keyword_sets.get("any", [])
     all_terms = keyword_sets.get("all", [])
     none_terms = keyword_sets.get("none", [])
@@ -259,7 +508,19 @@ def match_token_sets(tokens: List[str], keyword_sets: Dict[str, List[str]]) -> b
     if not any_terms and not all_terms and not none_terms:
         return True
 
-    token_set = set(tokens)
+    token_set = tokens if isinstance(tokens, (set, frozenset)) else set(tokens)
+    if "_any_set" in keyword_sets:
+        any_set = keyword_sets["_any_set"]
+        if any_set and any_set.isdisjoint(token_set):
+            return False
+        all_set = keyword_sets["_all_set"]
+        if all_set and not all_set.issubset(token_set):
+            return False
+        none_set = keyword_sets["_none_set"]
+        if none_set and not none_set.isdisjoint(token_set):
+            return False
+        return True
+
     if any_terms and not any(term in token_set for term in any_terms):
         return False
     if all_terms and not all(term in token_set for term in all_terms):
@@ -277,6 +538,17 @@ def match_text_sets(text: str, keyword_sets: Dict[str, List[str]], match_type: s
     if not any_terms and not all_terms and not none_terms:
         return True
 
+    if "_any_re" in keyword_sets:
+        any_re = keyword_sets["_any_re"]
+        if any_re is not None and not any_re.search(text):
+            return False
+        if any(pattern is not None and not pattern.search(text) for pattern in keyword_sets["_all_res"]):
+            return False
+        none_re = keyword_sets["_none_re"]
+        if none_re is not None and none_re.search(text):
+            return False
+        return True
+
     def predicate(term: str) -> bool:
         if match_type == "exact":
             return text == term
@@ -302,55 +574,61 @@ def rule_matches_context(rule: Dict, context: Dict) -> bool:
     if match_type == "regex":
         return match_regex_sets(context.get("raw_text", "") or "", keyword_sets)
     if match_type == "token":
-        return match_token_sets(context.get("tokens", []) or [], keyword_sets)
+        token_set = context.get("token_set")
+        if token_set is None:
+            token_set = context.get("tokens", []) or []
+        return match_token_sets(token_set, keyword_sets)
     return match_text_sets(context.get("normalized_text", "") or "", keyword_sets, match_type)
 
 
-def combine_contexts(rule: Dict, contexts: List[Dict], scope: str) -> bool:
+def combine_contexts(rule: Dict, contexts: List[Dict], any_context: bool) -> bool:
     if not contexts:
         return False
-    if scope == "either":
+    if any_context:
         return any(rule_matches_context(rule, ctx) for ctx in contexts)
-    if scope == "both":
-        return all(rule_matches_context(rule, ctx) for ctx in contexts)
     return all(rule_matches_context(rule, ctx) for ctx in contexts)
 
 
 def entry_context(entry: Dict) -> Dict:
+    tokens = entry.get("tokens", []) or []
     return {
         "normalized_text": entry.get("normalized_text", ""),
         "raw_text": entry.get("raw_text", ""),
-        "tokens": entry.get("tokens", []) or [],
+        "tokens": tokens,
+        "token_set": frozenset(tokens),
     }
 
 
-def segment_context(segment: Dict) -> Dict:
-    return segment.setdefault(
-        "_context",
-        {
-            "normalized_text": " ".join(e.get("normalized_text", "") for e in segment.get("entries", [])) or "",
-            "raw_text": " ".join(e.get("raw_text", "") for e in segment.get("entries", [])) or "",
-            "tokens": [token for e in segment.get("entries", []) for token in e.get("tokens", [])],
-        },
-    )
+def attach_segment_context(segment: Dict, needs_raw_text: bool = True) -> Dict:
+    """Build the segment's match context exactly once, at segment-close time."""
+    entries = segment.get("entries", [])
+    tokens = tuple(itertools.chain.from_iterable(entry.get("tokens", ()) for entry in entries))
+    context = {
+        "normalized_text": " ".join(e.get("normalized_text", "") for e in entries),
+        "tokens": tokens,
+        "token_set": frozenset(tokens),
+    }
+    if needs_raw_text:
+        # Only regex rules read raw_text; skip the join when none exist.
+        context["raw_text"] = " ".join(e.get("raw_text", "") for e in entries)
+    segment["_context"] = context
+    return segment
 
 
 def action_rule_matches(rule: Dict, entry_ctx: Dict, segment_ctx: Optional[Dict]) -> bool:
-    scope = (rule.get("scope") or "entry").lower()
     contexts: List[Dict] = []
 
-    if scope in {"entry", "both", "either"} and entry_ctx:
+    if rule["_scope_entry"] and entry_ctx:
         contexts.append(entry_ctx)
-    if scope in {"segment", "both", "either"} and segment_ctx:
+    if rule["_scope_segment"] and segment_ctx:
         contexts.append(segment_ctx)
 
-    if scope == "both" and len(contexts) < 2:
+    if rule["_scope_both"] and len(contexts) < 2:
         return False
     if not contexts:
         return False
 
-    normalized_scope = scope if scope in {"either", "both"} else "entry"
-    return combine_contexts(rule, contexts, normalized_scope)
+    return combine_contexts(rule, contexts, rule["_scope_either"])
 
 
 def transition_rule_matches(rule: Dict, prev_ctx: Optional[Dict], next_ctx: Optional[Dict], gap: float) -> bool:
@@ -360,42 +638,56 @@ def transition_rule_matches(rule: Dict, prev_ctx: Optional[Dict], next_ctx: Opti
     if max_gap is not None and gap > max_gap:
         return False
 
-    scope = (rule.get("scope") or "either").lower()
     contexts: List[Dict] = []
-    if scope in {"previous", "both", "either"} and prev_ctx:
+    if rule["_scope_previous"] and prev_ctx:
         contexts.append(prev_ctx)
-    if scope in {"next", "both", "either"} and next_ctx:
+    if rule["_scope_next"] and next_ctx:
         contexts.append(next_ctx)
 
-    if scope == "both" and len(contexts) < 2:
+    if rule["_scope_both"] and len(contexts) < 2:
         return False
     if not contexts:
         contexts = [next_ctx] if next_ctx else []
     if not contexts:
         return False
 
-    normalized_scope = scope if scope in {"either", "both"} else "entry"
-    return combine_contexts(rule, contexts, normalized_scope)
+    return combine_contexts(rule, contexts, rule["_scope_either"])
 
 
-def parse_srt_blocks(raw_srt: str):
-    blocks = re.split(r"\n\s*\n", raw_srt.strip(), flags=re.M)
-    for block in blocks:
-        lines = [line.strip() for line in block.splitlines() if line.strip()]
-        if len(lines) < 2:
-            continue
-        times = lines[1]
-        text_lines = lines[2:]
-        if not text_lines:
-            continue
-        try:
-            start_raw, end_raw = [part.strip() for part in times.split("-->")]
-        except ValueError:
-            continue
-        yield start_raw, end_raw, " ".join(text_lines)
+def _emit_srt_block(lines: List[str]):
+    if len(lines) < 2:
+        return None
+    times = lines[1]
+    text_lines = lines[2:]
+    if not text_lines:
+        return None
+    try:
+        start_raw, end_raw = [part.strip() for part in times.split("-->")]
+    except ValueError:
+        return None
+    return start_raw, end_raw, " ".join(text_lines)
+
+
+def parse_srt_blocks(lines):
+    """Stream blocks in one pass over an iterable of lines (an open file
+    works) instead of regex-splitting a full buffer into block strings."""
+    current: List[str] = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped:
+            current.append(stripped)
+        elif current:
+            block = _emit_srt_block(current)
+            if block:
+                yield block
+            current = []
+    if current:
+        block = _emit_srt_block(current)
+        if block:
+            yield block
 
 
-def build_segments(entries, merge_gap):
+def build_segments(entries, merge_gap, needs_raw_text: bool = True):
     segments = []
     current = None
     for entry in entries:
@@ -413,14 +705,14 @@ def build_segments(entries, merge_gap):
             current["end"] = max(current["end"], entry["end"])
             current["entries"].append(entry)
         else:
-            segments.append(current)
+            segments.append(attach_segment_context(current, needs_raw_text))
             current = {
                 "start": entry["start"],
                 "end": entry["end"],
                 "entries": [entry],
             }
     if current:
-        segments.append(current)
+        segments.append(attach_segment_context(current, needs_raw_text))
     return segments
 
 
@@ -459,22 +751,28 @@ def load_env_overrides() -> Dict[str, float]:
 def guess_transition_type(
     rule: Dict, *, default_type: str, asset: Optional[str] = None
 ) -> Dict[str, object]:
-    asset_lower = (asset or "").lower()
+    if "_asset_is_slide" in rule:
+        asset_is_slide = rule["_asset_is_slide"]
+        direction_from_asset = rule["_direction_from_asset"]
+    else:
+        # Rules built outside load_mapping still pay the scan once here.
+        asset_lower = (asset or "").lower()
+        asset_is_slide = "slide" in asset_lower
+        direction_from_asset = next(
+            (candidate for candidate in ("left", "right", "up", "down") if candidate in asset_lower),
+            None,
+        )
+
     requested_type = (rule.get("type") or default_type or "").strip()
     if requested_type:
         transition_type = requested_type
     else:
         transition_type = "fadeCamera"
 
-    if transition_type == "fadeCamera" and "slide" in asset_lower:
+    if transition_type == "fadeCamera" and asset_is_slide:
         transition_type = "slideWhoosh"
 
-    direction = rule.get("direction")
-    if not direction:
-        for candidate in ("left", "right", "up", "down"):
-            if candidate in asset_lower:
-                direction = candidate
-                break
+    direction = rule.get("direction") or direction_from_asset
 
     plan: Dict[str, object] = {
         "type": transition_type,
@@ -507,6 +805,37 @@ def build_transition_plan(rule: Dict, default_duration: float, default_type: str
     return transition_plan
 
 
+def export_segment_plan(segment: Dict, index: int) -> Dict:
+    segment_plan = {
+        "id": segment.get("id") or f"segment-{index + 1:02d}",
+        "sourceStart": round_ts(segment["start"]),
+        "duration": round_ts(segment["end"] - segment["start"]),
+    }
+    if segment.get("transition_in") is not None:
+        segment_plan["transitionIn"] = segment["transition_in"]
+    if segment.get("transition_out") is not None:
+        segment_plan["transitionOut"] = segment["transition_out"]
+
+    segment_plan["kind"] = segment.get("kind") or "normal"
+
+    label_text = ""
+    for entry in segment.get("entries", []):
+        candidate = collapse_text(entry.get("raw_text") or "", max_length=60)
+        if candidate:
+            label_text = candidate
+            break
+    if label_text:
+        segment_plan["label"] = label_text
+
+    if "silence_after" in segment:
+        segment_plan["silenceAfter"] = bool(segment["silence_after"])
+    if segment.get("gap_after") is not None:
+        segment_plan.setdefault("metadata", {})
+        segment_plan["metadata"]["gapAfterSeconds"] = round_ts(segment.get("gap_after", 0.0))
+
+    return segment_plan
+
+
 def main(argv):
     if len(argv) < 4:
         print("Usage: python make_plan_from_srt.py <srt_file> <mapping.json> <output_plan.json>")
@@ -523,25 +852,52 @@ def main(argv):
     env_overrides = load_env_overrides()
     transitions_cfg.setdefault("min_pause_seconds", env_overrides.get("min_pause_seconds", 0.7))
     sfx_rules = mapping["actions"].get("sfx", [])
+    sfx_postings = mapping["actions"].get("sfx_postings", {})
+    sfx_universal = mapping["actions"].get("sfx_universal", list(range(len(sfx_rules))))
+    sfx_token_union = mapping["actions"].get("sfx_token_union", frozenset())
 
     if not srt_path.exists():
         raise FileNotFoundError(f"SRT file not found: {srt_path}")
 
-    raw_srt = srt_path.read_text(encoding="utf-8")
+    min_duration = segment_cfg.get("min_duration", 0.0)
+    ratio_threshold = filler_cfg.get("ratio_threshold", 1.0)
+
+    # Stream the file line by line: peak memory stays O(longest block)
+    # instead of the whole transcript buffer. newline='' skips text-mode
+    # newline translation; strip() in the parser drops any \r.
+    with srt_path.open(encoding="utf-8", newline="") as handle:
+        rows = list(parse_srt_blocks(handle))
+    normalized_texts = [normalize(raw_text) for _, _, raw_text in rows]
+
+    # Tokenize the whole transcript with one regex pass: entries are joined on
+    # a non-word separator and tokens bucketed back to their entry by offset.
+    # Interned tokens make repeated set/dict lookups pointer comparisons and
+    # deduplicate storage for common words across entries.
+    token_lists: List[List[str]] = [[] for _ in rows]
+    if rows:
+        boundaries = [0]
+        for text in normalized_texts[:-1]:
+            boundaries.append(boundaries[-1] + len(text) + 1)
+        for match in WORD_RE.finditer("\x1f".join(normalized_texts)):
+            token_lists[bisect_right(boundaries, match.start()) - 1].append(
+                sys.intern(match.group(0))
+            )
 
     entries = []
-    for start_raw, end_raw, raw_text in parse_srt_blocks(raw_srt):
-        normalized_text = normalize(raw_text)
-        tokens = WORD_RE.findall(normalized_text)
-        start = hms_to_seconds(start_raw)
-        end = hms_to_seconds(end_raw)
+    # Bind the per-entry callables to locals: LOAD_FAST instead of
+    # LOAD_GLOBAL on every row of a long transcript.
+    _hms = hms_to_seconds
+    _filler_ratio = compute_filler_ratio
+    _context = entry_context
+    for row_index, (start_raw, end_raw, raw_text) in enumerate(rows):
+        normalized_text = normalized_texts[row_index]
+        tokens = token_lists[row_index]
+        start = _hms(start_raw)
+        end = _hms(end_raw)
         duration = max(0.0, end - start)
 
-        filler_ratio = compute_filler_ratio(tokens, normalized_text, filler_cfg.get("phrases", []))
-        keep = (
-            duration >= segment_cfg.get("min_duration", 0.0)
-            and filler_ratio < filler_cfg.get("ratio_threshold", 1.0)
-        )
+        filler_ratio = _filler_ratio(tokens, normalized_text, filler_cfg)
+        keep = duration >= min_duration and filler_ratio < ratio_threshold
 
         entry = {
             "start": start,
@@ -553,20 +909,12 @@ def main(argv):
             "filler_ratio": filler_ratio,
             "keep": keep,
         }
-        entry["_context"] = entry_context(entry)
+        entry["_context"] = _context(entry)
         entries.append(entry)
 
-    segments = build_segments(entries, segment_cfg.get("merge_gap_seconds", 0.5))
-
-    timeline_cursor = 0.0
-    for segment in segments:
-        segment_duration = max(0.0, segment["end"] - segment["start"])
-        segment["timeline_start"] = timeline_cursor
-        for entry in segment["entries"]:
-            entry_offset = max(0.0, entry["start"] - segment["start"])
-            entry["timeline_start"] = timeline_cursor + entry_offset
-        segment_context(segment)
-        timeline_cursor += segment_duration
+    segments = build_segments(
+        entries, segment_cfg.get("merge_gap_seconds", 0.5), mapping["needs_raw_text"]
+    )
 
     transition_default = transitions_cfg.get("default", {})
     transition_default.setdefault("type", env_overrides.get("default_transition_type", "fadeCamera"))
@@ -574,14 +922,20 @@ def main(argv):
     transition_rules = transitions_cfg.get("rules", [])
 
     highlights: List[Dict] = []
-    last_sfx_time = defaultdict(lambda: -math.inf)
+    highlights_need_sort = False
+    last_highlight_start = _NEG_INF
+    last_sfx_time = [_NEG_INF] * mapping["actions"].get("cooldown_slots", 0)
     try:
         min_pause_seconds = float(transitions_cfg.get("min_pause_seconds", 0.7) or 0.0)
     except (TypeError, ValueError):
         min_pause_seconds = 0.7
 
+    # Single forward walk: visiting segment N settles segment N-1's gap and
+    # transition, so N-1 can be exported immediately while its dicts are hot.
+    timeline_cursor = 0.0
+    exported_segments: List[Dict] = []
     for index, segment in enumerate(segments):
-        segment_start_timeline = segment["timeline_start"]
+        segment_start_timeline = timeline_cursor
         segment_ctx = segment.get("_context")
         segment["id"] = segment.get("id") or f"segment-{index + 1:02d}"
 
@@ -609,6 +963,7 @@ def main(argv):
                     if not asset and not rule.get("type") and not transition_default.get("type"):
                         continue
                     if transition_rule_matches(rule, prev_ctx, segment_ctx, gap):
+                        asset_traits = rule if rule.get("asset") else transition_default
                         selected_rule = {
                             "asset": asset,
                             "duration": rule.get("duration", transition_default.get("duration", 0.5)),
@@ -616,6 +971,8 @@ def main(argv):
                             "type": rule.get("type") or transition_default.get("type"),
                             "sfx": rule.get("sfx") or transition_default.get("sfx"),
                             "direction": rule.get("direction"),
+                            "_asset_is_slide": asset_traits["_asset_is_slide"],
+                            "_direction_from_asset": asset_traits["_direction_from_asset"],
                         }
                         break
 
@@ -629,6 +986,8 @@ def main(argv):
                             "type": transition_default.get("type"),
                             "sfx": transition_default.get("sfx"),
                             "direction": transition_default.get("direction"),
+                            "_asset_is_slide": transition_default["_asset_is_slide"],
+                            "_direction_from_asset": transition_default["_direction_from_asset"],
                         }
 
                 if selected_rule:
@@ -648,22 +1007,34 @@ def main(argv):
                 prev_segment.pop("transition_out", None)
                 segment.pop("transition_in", None)
 
+            exported_segments.append(export_segment_plan(prev_segment, index - 1))
+
         for entry in segment["entries"]:
             if not entry["keep"]:
                 continue
-            entry_start_timeline = entry.get("timeline_start", segment_start_timeline)
+            entry_start_timeline = segment_start_timeline + max(0.0, entry["start"] - segment["start"])
             entry_ctx = entry.get("_context")
 
-            for rule in sfx_rules:
+            # One intersection against the union of indexed any-terms decides
+            # whether the postings lookup (or the whole loop) can be skipped.
+            token_set = entry_ctx.get("token_set", ())
+            if sfx_token_union and not sfx_token_union.isdisjoint(token_set):
+                hits = {index for token in token_set for index in sfx_postings.get(token, ())}
+                candidate_ids = sorted(hits.union(sfx_universal))
+            elif sfx_universal:
+                candidate_ids = sfx_universal
+            else:
+                continue
+
+            for rule_index in candidate_ids:
+                rule = sfx_rules[rule_index]
                 if not rule.get("asset"):
                     continue
                 if not action_rule_matches(rule, entry_ctx, segment_ctx):
                     continue
-                candidate_time = entry_start_timeline + float(rule.get("offset", 0.0))
-                cooldown_key = rule.get("_cooldown_key") or rule.get("asset")
-                if candidate_time - last_sfx_time[cooldown_key] >= float(
-                    rule.get("cooldown", 0.0)
-                ):
+                candidate_time = entry_start_timeline + rule["_offset_f"]
+                cooldown_id = rule["_cooldown_id"]
+                if candidate_time - last_sfx_time[cooldown_id] >= rule["_cooldown_f"]:
                     highlight_index = len(highlights)
                     highlight_duration = round_ts(min(max(entry["duration"], 1.6), 4.0))
                     highlight_text = collapse_text(entry.get("raw_text") or "")
@@ -679,16 +1050,22 @@ def main(argv):
                             normalized_asset = normalized_asset[4:]
                         sfx_name = normalized_asset or None
                     start_time = max(0.0, candidate_time)
-                    highlight_type = cycle_choice(HIGHLIGHT_TYPES, highlight_index)
+                    highlight_start = round_ts(start_time)
+                    # Emission follows timeline order unless a negative rule
+                    # offset pulls a highlight before its predecessor.
+                    if highlight_start < last_highlight_start:
+                        highlights_need_sort = True
+                    else:
+                        last_highlight_start = highlight_start
                     highlight = {
                         "id": f"highlight-{highlight_index + 1:02d}",
-                        "type": highlight_type,
+                        "type": HIGHLIGHT_TYPES[highlight_index % _N_TYPES],
                         "text": highlight_text,
-                        "start": round_ts(start_time),
+                        "start": highlight_start,
                         "duration": highlight_duration,
-                        "position": cycle_choice(HIGHLIGHT_POSITIONS, highlight_index),
-                        "animation": cycle_choice(HIGHLIGHT_ANIMATIONS, highlight_index),
-                        "variant": cycle_choice(HIGHLIGHT_VARIANTS, highlight_index),
+                        "position": HIGHLIGHT_POSITIONS[highlight_index % _N_POSITIONS],
+                        "animation": HIGHLIGHT_ANIMATIONS[highlight_index % _N_ANIMATIONS],
+                        "variant": HIGHLIGHT_VARIANTS[highlight_index % _N_VARIANTS],
                     }
                     if sfx_name:
                         if not sfx_name.lower().startswith("assets/"):
@@ -705,49 +1082,20 @@ def main(argv):
                         except (TypeError, ValueError):
                             pass
                     highlights.append(highlight)
-                    last_sfx_time[cooldown_key] = candidate_time
+                    last_sfx_time[cooldown_id] = candidate_time
                     break
 
-    if segments:
-        segments[-1].setdefault("silence_after", False)
-        segments[-1].setdefault("gap_after", 0.0)
-
-    exported_segments = []
-    for index, segment in enumerate(segments):
-        segment_plan = {
-            "id": segment.get("id") or f"segment-{index + 1:02d}",
-            "sourceStart": round_ts(segment["start"]),
-            "duration": round_ts(segment["end"] - segment["start"]),
-            "transitionIn": segment.get("transition_in"),
-            "transitionOut": segment.get("transition_out"),
-        }
-
-        segment_plan["kind"] = segment.get("kind") or "normal"
+        timeline_cursor += max(0.0, segment["end"] - segment["start"])
 
-        label_text = ""
-        for entry in segment.get("entries", []):
-            candidate = collapse_text(entry.get("raw_text") or "", max_length=60)
-            if candidate:
-                label_text = candidate
-                break
-        if label_text:
-            segment_plan["label"] = label_text
-
-        if "silence_after" in segment:
-            segment_plan["silenceAfter"] = bool(segment["silence_after"])
-        if segment.get("gap_after") is not None:
-            segment_plan.setdefault("metadata", {})
-            segment_plan["metadata"]["gapAfterSeconds"] = round_ts(segment.get("gap_after", 0.0))
-
-        exported_segments.append(segment_plan)
-
-    for segment in exported_segments:
-        if segment.get("transitionIn") is None:
-            segment.pop("transitionIn", None)
-        if segment.get("transitionOut") is None:
-            segment.pop("transitionOut", None)
+    if segments:
+        last_segment = segments[-1]
+        last_segment.setdefault("silence_after", False)
+        last_segment.setdefault("gap_after", 0.0)
+        exported_segments.append(export_segment_plan(last_segment, len(segments) - 1))
 
-    highlights.sort(key=lambda item: item.get("start", 0.0))
+    if highlights_need_sort:
+        # Every emitted highlight carries "start"; itemgetter runs in C.
+        highlights.sort(key=itemgetter("start"))
 
     plan = {
         "segments": exported_segments,
@@ -762,9 +1110,12 @@ def main(argv):
         },
     }
 
-    with output_path.open("w", encoding="utf-8") as handle:
-        json.dump(plan, handle, indent=2)
-        handle.write("\n")
+    if orjson is not None:
+        output_path.write_bytes(orjson.dumps(plan, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+    else:
+        with output_path.open("w", encoding="utf-8") as handle:
+            json.dump(plan, handle, indent=2)
+            handle.write("\n")
 
     print(f"[PLAN] Saved plan -> {output_path}")
 
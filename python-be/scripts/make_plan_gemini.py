@@ -2,16 +2,30 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import datetime
+import functools
+import hashlib
 import json
 import os
+import pickle
+import random
 import re
 import sys
+from bisect import bisect_right
 from dataclasses import dataclass
+from itertools import islice
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List
 
-import google.generativeai as genai
-from dotenv import load_dotenv
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
 
 TIMECODE_RE = re.compile(r"^(?P<start>\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(?P<end>\d{2}:\d{2}:\d{2},\d{3})$")
 JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
@@ -27,6 +41,16 @@ def _humanize_sfx_description(relative_path: Path) -> str:
     return f"{category_title}: {base_title}"
 
 
+def _walk_sfx_assets(directory: Path) -> Iterable[Path]:
+    # Manual recursion filters by suffix before any further stat, unlike
+    # rglob("*") which yields (and stats) every entry in the tree.
+    for entry in directory.iterdir():
+        if entry.is_dir():
+            yield from _walk_sfx_assets(entry)
+        elif entry.suffix.lower() in SFX_EXTENSIONS and entry.is_file():
+            yield entry
+
+
 def discover_available_sfx() -> Dict[str, str]:
     root_dir = Path(__file__).resolve().parents[2]
     sfx_dir = root_dir / "assets" / "sfx"
@@ -35,9 +59,7 @@ def discover_available_sfx() -> Dict[str, str]:
     if not sfx_dir.exists():
         return available
 
-    for asset in sorted(sfx_dir.rglob("*")):
-        if not asset.is_file() or asset.suffix.lower() not in SFX_EXTENSIONS:
-            continue
+    for asset in sorted(_walk_sfx_assets(sfx_dir)):
         relative_path = asset.relative_to(sfx_dir)
         key = relative_path.as_posix()
         description = _humanize_sfx_description(relative_path)
@@ -48,7 +70,7 @@ def discover_available_sfx() -> Dict[str, str]:
     return available
 
 
-AVAILABLE_SFX: Dict[str, str] = discover_available_sfx() or {
+_DEFAULT_SFX: Dict[str, str] = {
     "ui/pop.mp3": "UI: Pop punchy nhấn mạnh",
     "whoosh/whoosh.mp3": "Whoosh chuyển cảnh mượt",
     "emphasis/ding.mp3": "Ding sạch cho số liệu quan trọng",
@@ -57,9 +79,9 @@ AVAILABLE_SFX: Dict[str, str] = discover_available_sfx() or {
 }
 
 
-def _build_sfx_lookup() -> Dict[str, str]:
+def _build_sfx_lookup(available: Dict[str, str]) -> Dict[str, str]:
     lookup: Dict[str, str] = {}
-    for key in AVAILABLE_SFX.keys():
+    for key in available.keys():
         lower_key = key.lower()
         lookup.setdefault(lower_key, key)
         name = Path(key).name.lower()
@@ -69,7 +91,59 @@ def _build_sfx_lookup() -> Dict[str, str]:
     return lookup
 
 
-SFX_LOOKUP = _build_sfx_lookup()
+_SFX_CACHE_PATH = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "video-automation" / "sfx_index.pkl"
+)
+
+
+def _sfx_dir_signature(sfx_dir: Path) -> tuple[int, ...] | None:
+    """Directory mtimes stand in for the full file walk: adding/removing an
+    asset bumps its parent directory, so only O(#dirs) stats are needed."""
+    try:
+        mtimes = [sfx_dir.stat().st_mtime_ns]
+    except OSError:
+        return None
+    for root, dirs, _files in os.walk(sfx_dir):
+        for name in dirs:
+            try:
+                mtimes.append(os.stat(os.path.join(root, name)).st_mtime_ns)
+            except OSError:
+                continue
+    return tuple(mtimes)
+
+
+def _load_sfx_index() -> tuple[Dict[str, str], Dict[str, str]]:
+    sfx_dir = Path(__file__).resolve().parents[2] / "assets" / "sfx"
+    signature = _sfx_dir_signature(sfx_dir)
+    if signature is not None:
+        try:
+            payload = pickle.loads(_SFX_CACHE_PATH.read_bytes())
+            if payload.get("signature") == signature:
+                return payload["available"], payload["lookup"]
+        except (OSError, pickle.PickleError, EOFError, KeyError):
+            pass
+
+    available = discover_available_sfx() or dict(_DEFAULT_SFX)
+    lookup = _build_sfx_lookup(available)
+
+    if signature is not None:
+        try:
+            _SFX_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = _SFX_CACHE_PATH.with_name(_SFX_CACHE_PATH.name + ".tmp")
+            tmp_path.write_bytes(
+                pickle.dumps({"signature": signature, "available": available, "lookup": lookup})
+            )
+            os.replace(tmp_path, _SFX_CACHE_PATH)
+        except OSError:
+            pass
+    return available, lookup
+
+
+AVAILABLE_SFX, SFX_LOOKUP = _load_sfx_index()
+
+# Prompt-facing renderings of the catalog, joined once at import.
+_SFX_NAMES_STR = ", ".join(AVAILABLE_SFX)
+_SFX_NOTES_STR = "; ".join(f"{name}: {desc}" for name, desc in AVAILABLE_SFX.items())
 TRANSITION_TYPES = ["cut", "crossfade", "slide", "zoom", "scale", "rotate", "blur"]
 TRANSITION_DIRECTIONS = ["left", "right", "up", "down"]
 HIGHLIGHT_POSITIONS = ["top", "center", "bottom"]
@@ -86,47 +160,119 @@ HIGHLIGHT_ANIMATIONS = [
     "pop",
 ]
 HIGHLIGHT_VARIANTS = ["callout", "blurred", "brand", "cutaway", "typewriter"]
+
+# Frozenset mirrors of the option lists for O(1) membership tests; the lists
+# stay ordered for prompt rendering.
+_TRANSITION_TYPES_SET = frozenset(TRANSITION_TYPES)
+_TRANSITION_DIRECTIONS_SET = frozenset(TRANSITION_DIRECTIONS)
+_HIGHLIGHT_POSITIONS_SET = frozenset(HIGHLIGHT_POSITIONS)
+_HIGHLIGHT_VARIANTS_SET = frozenset(HIGHLIGHT_VARIANTS)
+_SLIDE_ALIAS = {f"slide-{direction}": direction for direction in TRANSITION_DIRECTIONS}
+
 MAX_HIGHLIGHTS = 6
 DEFAULT_HIGHLIGHT_DURATION = 2.6
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SrtEntry:
     index: int
     start: str
     end: str
     text: str
-
-    @property
-    def text_one_line(self) -> str:
-        return " ".join(line.strip() for line in self.text.splitlines() if line.strip())
+    # Flattened once at parse time; read by prompt building, truncation and
+    # the cache key, so a recomputing property would re-split per access.
+    text_one_line: str
+    # Prompt line formatted once here; build_transcript_section then joins
+    # stored strings instead of re-running the f-string per prompt build.
+    timeline_line: str
 
 
 def seconds_from_timecode(value: str) -> float:
+    # SRT timecodes are fixed-width (HH:MM:SS,mmm); slicing skips the two
+    # split() allocations on the common shape.
+    if len(value) == 12 and value[2] == ":" and value[5] == ":" and value[8] == ",":
+        return (
+            int(value[:2]) * 3600
+            + int(value[3:5]) * 60
+            + int(value[6:8])
+            + int(value[9:12]) / 1000
+        )
     hours, minutes, remainder = value.split(":")
     seconds, millis = remainder.split(",")
     return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000
 
 
+def _split_timecode_line(line: str) -> tuple[str, str] | None:
+    """Split "HH:MM:SS,mmm --> HH:MM:SS,mmm" without the regex when the line
+    has the canonical fixed width; TIMECODE_RE stays the fallback for
+    producers with extra whitespace."""
+    if len(line) == 29 and line.isascii() and line[12:17] == " --> ":
+        start = line[:12]
+        end = line[17:]
+        if (
+            start[2] == ":" and start[5] == ":" and start[8] == ","
+            and end[2] == ":" and end[5] == ":" and end[8] == ","
+            and start[:2].isdigit() and start[3:5].isdigit()
+            and start[6:8].isdigit() and start[9:].isdigit()
+            and end[:2].isdigit() and end[3:5].isdigit()
+            and end[6:8].isdigit() and end[9:].isdigit()
+        ):
+            return start, end
+    match = TIMECODE_RE.match(line)
+    if match:
+        return match.group("start"), match.group("end")
+    return None
+
+
 def parse_srt(path: Path, *, max_entries: int | None = None) -> List[SrtEntry]:
-    content = path.read_text(encoding="utf-8")
-    blocks = re.split(r"\n\s*\n", content.strip())
+    """Stream the file line by line instead of materializing every block.
+
+    Blank lines close a block; hitting max_entries stops reading early, which
+    matters when only the head of a long transcript is sent to Gemini."""
     entries: List[SrtEntry] = []
-    for block in blocks:
-        lines = [line for line in block.splitlines() if line.strip()]
+
+    def emit(lines: List[str]) -> None:
         if len(lines) < 2:
-            continue
+            return
         try:
             idx = int(lines[0])
         except ValueError:
             idx = len(entries) + 1
-        match = TIMECODE_RE.match(lines[1])
-        if not match:
-            continue
-        text = "\n".join(lines[2:]) if len(lines) > 2 else ""
-        entries.append(SrtEntry(index=idx, start=match.group("start"), end=match.group("end"), text=text))
-        if max_entries and len(entries) >= max_entries:
-            break
+        timecodes = _split_timecode_line(lines[1])
+        if timecodes is None:
+            return
+        if len(lines) > 2:
+            text = "\n".join(lines[2:])
+            one_line = " ".join(line.strip() for line in lines[2:])
+        else:
+            text = ""
+            one_line = ""
+        start, end = timecodes
+        entries.append(
+            SrtEntry(
+                index=idx,
+                start=start,
+                end=end,
+                text=text,
+                text_one_line=one_line,
+                timeline_line=f"{idx}. [{start} -> {end}] {one_line}",
+            )
+        )
+
+    pending: List[str] = []
+    with path.open("r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.rstrip("\r\n")
+            if line.strip():
+                pending.append(line)
+                continue
+            if pending:
+                emit(pending)
+                pending = []
+                if max_entries and len(entries) >= max_entries:
+                    return entries
+        if pending:
+            emit(pending)
     return entries
 
 
@@ -134,61 +280,81 @@ def _format_available(values: Iterable[str]) -> str:
     return ", ".join(values)
 
 
-def build_prompt(entries: Iterable[SrtEntry], *, extra_instructions: str | None = None) -> str:
-    timeline_lines = []
-    for entry in entries:
-        snippet = entry.text_one_line
-        timeline_lines.append(f"{entry.index}. [{entry.start} -> {entry.end}] {snippet}")
-    transcript_section = "\n".join(timeline_lines)
-
-    schema_hint = {
-        "segments": [
-            {
-                "id": "intro",
-                "sourceStart": 0.0,
-                "duration": 6.4,
-                "transitionOut": {"type": "crossfade", "duration": 0.6},
-            },
-            {
-                "id": "demo",
-                "sourceStart": 6.4,
-                "duration": 9.1,
-                "transitionIn": {"type": "crossfade", "duration": 0.6},
-                "transitionOut": {"type": "slide", "duration": 0.5, "direction": "left"},
-            },
-        ],
-        "highlights": [
-            {
-                "id": "hook",
-                "text": "KEY IDEA: Stay consistent",
-                "start": 2.4,
-                "duration": 2.6,
-                "position": "center",
-                "animation": "zoom",
-                "sfx": "ui/pop.mp3",
-                "volume": 0.75,
-            }
-        ],
-    }
+BASE_INSTRUCTIONS = (
+    "Bạn là editor phụ trợ. Tạo JSON plan cho Remotion với các segment cắt gọn, transition mượt, highlight text và SFX hợp lý. "
+    "Giữ tổng thể cinematic, tránh spam hiệu ứng."
+)
+
+
+def build_transcript_section(entries: Iterable[SrtEntry]) -> str:
+    return "\n".join(entry.timeline_line for entry in entries)
+
+
+def truncate_to_token_budget(entries: List[SrtEntry], token_budget: int) -> List[SrtEntry]:
+    """Keep a prefix of entries whose transcript section fits the token budget.
+
+    Uses the ~4 chars/token heuristic instead of a count_tokens round trip; it
+    only has to be roughly right, the budget is a safety margin below the
+    model window, not a hard API limit."""
+    if token_budget <= 0:
+        return entries
+    estimated = 0
+    for position, entry in enumerate(entries):
+        line_chars = len(entry.text_one_line) + len(entry.start) + len(entry.end) + 12
+        estimated += line_chars // 4
+        if estimated > token_budget and position:
+            print(
+                f"[WARN] Transcript truncated to {position}/{len(entries)} entries "
+                f"to stay within ~{token_budget} tokens"
+            )
+            return entries[:position]
+    return entries
 
-    sfx_names = _format_available(AVAILABLE_SFX.keys())
-    sfx_notes = "; ".join(f"{name}: {desc}" for name, desc in AVAILABLE_SFX.items())
+
+_SCHEMA_HINT = {
+    "segments": [
+        {
+            "id": "intro",
+            "sourceStart": 0.0,
+            "duration": 6.4,
+            "transitionOut": {"type": "crossfade", "duration": 0.6},
+        },
+        {
+            "id": "demo",
+            "sourceStart": 6.4,
+            "duration": 9.1,
+            "transitionIn": {"type": "crossfade", "duration": 0.6},
+            "transitionOut": {"type": "slide", "duration": 0.5, "direction": "left"},
+        },
+    ],
+    "highlights": [
+        {
+            "id": "hook",
+            "text": "KEY IDEA: Stay consistent",
+            "start": 2.4,
+            "duration": 2.6,
+            "position": "center",
+            "animation": "zoom",
+            "sfx": "ui/pop.mp3",
+            "volume": 0.75,
+        }
+    ],
+}
+_SCHEMA_HINT_JSON = json.dumps(_SCHEMA_HINT, indent=2)
+
+
+@functools.lru_cache(maxsize=1)
+def _static_rules_block() -> str:
+    sfx_names = _SFX_NAMES_STR
+    sfx_notes = _SFX_NOTES_STR
     transition_types = _format_available(TRANSITION_TYPES)
     transition_directions = _format_available(TRANSITION_DIRECTIONS)
     highlight_positions = _format_available(HIGHLIGHT_POSITIONS)
     highlight_animations = _format_available(HIGHLIGHT_ANIMATIONS)
 
-    instructions = (
-        "Bạn là editor phụ trợ. Tạo JSON plan cho Remotion với các segment cắt gọn, transition mượt, highlight text và SFX hợp lý. "
-        "Giữ tổng thể cinematic, tránh spam hiệu ứng."
-    )
-    if extra_instructions:
-        instructions += f" Extra guidance from user: {extra_instructions.strip()}"
-
-    prompt = (
-        f"{instructions}\n\n"
+    return (
         "Xuất JSON hợp lệ đúng schema (ví dụ dưới chỉ minh họa, hãy cập nhật giá trị thực tế):\n"
-        f"{json.dumps(schema_hint, indent=2)}\n\n"
+        f"{_SCHEMA_HINT_JSON}\n\n"
         "Rules:\n"
         "- `segments` chứa các đoạn theo timeline với `sourceStart` (giây trong video gốc) và `duration`. Có thể thêm `label` mô tả ngắn.\n"
         "- `transitionIn`/`transitionOut` dùng `type` thuộc: "
@@ -215,27 +381,100 @@ def build_prompt(entries: Iterable[SrtEntry], *, extra_instructions: str | None
         "- Nếu highlight có SFX, đặt `start` khớp moment cần nhấn và cân nhắc `volume` (0-1).\n"
         "- Đảm bảo các segment nối tiếp nhau không bị gap thời gian.\n"
         "- Chỉ trả về JSON trong một code block.\n\n"
-        "Transcript segments (ordered):\n"
-        f"{transcript_section}\n"
     )
-    return prompt
+
+
+@functools.lru_cache(maxsize=1)
+def build_static_preamble() -> str:
+    """Static prompt head (instructions + schema + rules + catalogs).
+
+    Byte-stable across runs so it can be registered once as server-side
+    cached content."""
+    return f"{BASE_INSTRUCTIONS}\n\n{_static_rules_block()}"
+
+
+def build_prompt(entries: Iterable[SrtEntry], *, extra_instructions: str | None = None) -> str:
+    # The static prefix stays byte-identical across runs (extra guidance goes
+    # after it) so Gemini's implicit prefix caching can hit.
+    return build_static_preamble() + build_transcript_prompt(
+        entries, extra_instructions=extra_instructions
+    )
+
+
+def build_transcript_prompt(entries: Iterable[SrtEntry], *, extra_instructions: str | None = None) -> str:
+    """Variable prompt tail sent as the user turn when the static preamble
+    lives in a server-side context cache."""
+    parts = []
+    if extra_instructions:
+        parts.append(f"Extra guidance from user: {extra_instructions.strip()}\n\n")
+    parts.append("Transcript segments (ordered):\n")
+    parts.append(build_transcript_section(entries))
+    parts.append("\n")
+    return "".join(parts)
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _first_json_object(text: str, start: int = 0) -> dict | None:
+    """Decode the first JSON object at or after `start` via raw_decode.
+
+    raw_decode walks the braces/strings in one forward pass, so multi-KB
+    responses never hit the DOTALL regex's backtracking."""
+    pos = text.find("{", start)
+    while pos != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            obj = None
+        if isinstance(obj, dict):
+            return obj
+        pos = text.find("{", pos + 1)
+    return None
 
 
 def extract_plan_json(text: str) -> dict:
+    # Fast path: with response_mime_type=application/json the reply is bare
+    # JSON, so one loads beats any scanning.
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        loads = orjson.loads if orjson is not None else json.loads
+        try:
+            obj = loads(stripped)
+        except ValueError:
+            pass
+        else:
+            if isinstance(obj, dict):
+                return obj
+
+    # Start scanning at the code fence when present so stray braces in any
+    # preamble prose cannot win over the fenced plan.
+    fence = text.find("```")
+    obj = _first_json_object(text, fence + 3 if fence != -1 else 0)
+    if obj is not None:
+        return obj
+
+    # Fallback for malformed output (e.g. raw \r inside string literals).
     candidates: List[str] = []
     for match in JSON_BLOCK_RE.finditer(text):
         candidates.append(match.group(1).strip())
     if not candidates:
         candidates.append(text.strip())
 
+    loads = orjson.loads if orjson is not None else json.loads
     last_error: Exception | None = None
     for candidate in candidates:
-        for cleaned in (candidate, candidate.replace("\r", "")):
+        try:
+            return loads(candidate)
+        except ValueError as exc:
+            last_error = exc
+        if "\r" in candidate:
+            # Only pay for the copy when a stray carriage return could be
+            # the reason the first attempt failed.
             try:
-                return json.loads(cleaned)
-            except json.JSONDecodeError as exc:
+                return loads(candidate.replace("\r", ""))
+            except ValueError as exc:
                 last_error = exc
-                continue
     raise ValueError(f"Could not parse JSON from LLM response: {last_error}")
 
 
@@ -288,14 +527,17 @@ def normalize_sfx_name(value: Any) -> str | None:
     if candidate_normalized.startswith("sfx/"):
         candidate_normalized = candidate_normalized[4:]
 
-    checks = [
-        candidate_normalized.lower(),
-        Path(candidate_normalized).name.lower(),
-        Path(candidate_normalized).stem.lower(),
-    ]
-
-    for key in checks:
-        if not key:
+    # Catalog-exact names are the overwhelmingly common case; resolve them
+    # with one dict lookup before deriving basename/stem variants.
+    lowered = candidate_normalized.lower()
+    match = SFX_LOOKUP.get(lowered)
+    if match:
+        return match
+
+    name_only = lowered.rsplit("/", 1)[-1]
+    stem = name_only.rpartition(".")[0] or name_only
+    for key in (name_only, stem):
+        if not key or key == lowered:
             continue
         match = SFX_LOOKUP.get(key)
         if match:
@@ -336,11 +578,8 @@ def normalize_transition(value: Any) -> Dict[str, Any] | None:
 
     if transition_type in {"fade", "dissolve"}:
         transition_type = "crossfade"
-    elif transition_type in {"slide-left", "slide-right", "slide-up", "slide-down"}:
-        for candidate in TRANSITION_DIRECTIONS:
-            if candidate in transition_type:
-                direction = candidate
-                break
+    elif transition_type in _SLIDE_ALIAS:
+        direction = _SLIDE_ALIAS[transition_type]
         transition_type = "slide"
 
     elif transition_type in {"zoom-in", "zoom-out", "push", "push-in", "push-out", "punch", "punch-in", "punch-out"}:
@@ -352,7 +591,7 @@ def normalize_transition(value: Any) -> Dict[str, Any] | None:
     elif transition_type in {"focus", "defocus", "dream", "soft-focus", "soften"}:
         transition_type = "blur"
 
-    if transition_type not in TRANSITION_TYPES:
+    if transition_type not in _TRANSITION_TYPES_SET:
         transition_type = "cut"
 
     if transition_type == "cut":
@@ -371,7 +610,7 @@ def normalize_transition(value: Any) -> Dict[str, Any] | None:
         "duration": round(duration_value, 3),
     }
 
-    if transition_type == "slide" and direction in TRANSITION_DIRECTIONS:
+    if transition_type == "slide" and direction in _TRANSITION_DIRECTIONS_SET:
         transition["direction"] = direction
 
     if transition_type in {"zoom", "scale", "rotate", "blur"} and intensity_value:
@@ -431,7 +670,7 @@ def normalize_highlight_item(raw: Dict[str, Any], index: int) -> Dict[str, Any]
     duration = max(1.5, min(duration, 5.0))
 
     position = (raw.get("position") or raw.get("placement") or "center").lower()
-    if position not in HIGHLIGHT_POSITIONS:
+    if position not in _HIGHLIGHT_POSITIONS_SET:
         position = "center"
 
     animation_raw = raw.get("animation") or raw.get("style") or raw.get("motion")
@@ -513,7 +752,7 @@ def normalize_highlight_item(raw: Dict[str, Any], index: int) -> Dict[str, Any]
             "typewriter": "typewriter",
         }
         normalized_variant = variant_map.get(variant_key)
-        if normalized_variant in HIGHLIGHT_VARIANTS:
+        if normalized_variant in _HIGHLIGHT_VARIANTS_SET:
             highlight["variant"] = normalized_variant
 
     sfx_value = raw.get("sfx") or raw.get("asset") or raw.get("sound")
@@ -564,139 +803,173 @@ def normalize_highlight_item(raw: Dict[str, Any], index: int) -> Dict[str, Any]
     return highlight
 
 
-def normalize_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
-    if not isinstance(plan, dict):
-        raise ValueError("Plan must be a JSON object.")
+def normalize_segment_item(raw_segment: Dict[str, Any], index: int) -> tuple[float, Dict[str, Any]] | None:
+    """Normalize one raw segment; returns (timeline_start, segment) or None to drop it."""
+    source_start = ensure_float(
+        raw_segment.get("sourceStart", raw_segment.get("start", 0.0)),
+        0.0,
+    )
+    duration = ensure_float(raw_segment.get("duration"))
+    if duration <= 0:
+        end_value = ensure_float(raw_segment.get("end"))
+        start_value = ensure_float(raw_segment.get("start", source_start))
+        if end_value > start_value:
+            duration = end_value - start_value
+    if duration <= 0:
+        length_value = ensure_float(raw_segment.get("length"))
+        if length_value > 0:
+            duration = length_value
+    if duration <= 0:
+        return None
 
-    segment_items: List[tuple[float, Dict[str, Any]]] = []
-    raw_segments = plan.get("segments")
-    if isinstance(raw_segments, list):
-        for index, raw_segment in enumerate(raw_segments):
-            if not isinstance(raw_segment, dict):
-                continue
-            source_start = ensure_float(
-                raw_segment.get("sourceStart", raw_segment.get("start", 0.0)),
-                0.0,
-            )
-            duration = ensure_float(raw_segment.get("duration"))
-            if duration <= 0:
-                end_value = ensure_float(raw_segment.get("end"))
-                start_value = ensure_float(raw_segment.get("start", source_start))
-                if end_value > start_value:
-                    duration = end_value - start_value
-            if duration <= 0:
-                length_value = ensure_float(raw_segment.get("length"))
-                if length_value > 0:
-                    duration = length_value
-            if duration <= 0:
-                continue
+    segment_plan: Dict[str, Any] = {
+        "id": str(raw_segment.get("id") or f"segment-{index + 1:02d}"),
+        "sourceStart": round(source_start, 3),
+        "duration": round(duration, 3),
+    }
 
-            segment_plan: Dict[str, Any] = {
-                "id": str(raw_segment.get("id") or f"segment-{index + 1:02d}"),
-                "sourceStart": round(source_start, 3),
-                "duration": round(duration, 3),
-            }
-
-            # Tạm thời vô hiệu hóa gắn nhãn segment `broll` để tránh chèn placeholder B-roll.
-            # if "kind" in raw_segment:
-            #     kind_value = normalize_segment_kind(raw_segment.get("kind"))
-            #     if kind_value:
-            #         segment_plan["kind"] = kind_value
-
-            label = (raw_segment.get("label") or raw_segment.get("title") or "").strip()
-            if label:
-                segment_plan["label"] = label
-
-            title_value = raw_segment.get("title")
-            if isinstance(title_value, str):
-                title_clean = title_value.strip()
-                if title_clean:
-                    segment_plan["title"] = title_clean
-
-            silence_after_raw = None
-            for key in ("silenceAfter", "silence_after"):
-                if key in raw_segment:
-                    silence_after_raw = raw_segment.get(key)
-                    break
-            if silence_after_raw is not None:
-                segment_plan["silenceAfter"] = ensure_bool(silence_after_raw)
-            else:
-                segment_plan["silenceAfter"] = False
+    # Tạm thời vô hiệu hóa gắn nhãn segment `broll` để tránh chèn placeholder B-roll.
+    # if "kind" in raw_segment:
+    #     kind_value = normalize_segment_kind(raw_segment.get("kind"))
+    #     if kind_value:
+    #         segment_plan["kind"] = kind_value
+
+    label = (raw_segment.get("label") or raw_segment.get("title") or "").strip()
+    if label:
+        segment_plan["label"] = label
+
+    title_value = raw_segment.get("title")
+    if isinstance(title_value, str):
+        title_clean = title_value.strip()
+        if title_clean:
+            segment_plan["title"] = title_clean
+
+    silence_after_raw = None
+    for key in ("silenceAfter", "silence_after"):
+        if key in raw_segment:
+            silence_after_raw = raw_segment.get(key)
+            break
+    if silence_after_raw is not None:
+        segment_plan["silenceAfter"] = ensure_bool(silence_after_raw)
+    else:
+        segment_plan["silenceAfter"] = False
 
-            gap_after_raw = None
-            for key in ("gapAfter", "gap_after"):
-                if key in raw_segment:
-                    gap_after_raw = raw_segment.get(key)
-                    break
-            if gap_after_raw is not None:
-                segment_plan["gapAfter"] = ensure_bool(gap_after_raw)
-
-            playback_raw = raw_segment.get("playbackRate", raw_segment.get("speed"))
-            if playback_raw is not None:
-                playback_rate = ensure_float(playback_raw, 1.0)
-                if playback_rate <= 0:
-                    playback_rate = 1.0
-                if abs(playback_rate - 1.0) > 1e-3:
-                    segment_plan["playbackRate"] = round(playback_rate, 3)
-
-            transition_in = normalize_transition(
-                raw_segment.get("transitionIn")
-                or raw_segment.get("transition_in")
-                or raw_segment.get("enterTransition")
-            )
-            if transition_in:
-                segment_plan["transitionIn"] = transition_in
+    gap_after_raw = None
+    for key in ("gapAfter", "gap_after"):
+        if key in raw_segment:
+            gap_after_raw = raw_segment.get(key)
+            break
+    if gap_after_raw is not None:
+        segment_plan["gapAfter"] = ensure_bool(gap_after_raw)
+
+    playback_raw = raw_segment.get("playbackRate", raw_segment.get("speed"))
+    if playback_raw is not None:
+        playback_rate = ensure_float(playback_raw, 1.0)
+        if playback_rate <= 0:
+            playback_rate = 1.0
+        if abs(playback_rate - 1.0) > 1e-3:
+            segment_plan["playbackRate"] = round(playback_rate, 3)
+
+    transition_in = normalize_transition(
+        raw_segment.get("transitionIn")
+        or raw_segment.get("transition_in")
+        or raw_segment.get("enterTransition")
+    )
+    if transition_in:
+        segment_plan["transitionIn"] = transition_in
 
-            transition_out = normalize_transition(
-                raw_segment.get("transitionOut")
-                or raw_segment.get("transition_out")
-                or raw_segment.get("exitTransition")
-            )
-            if transition_out:
-                segment_plan["transitionOut"] = transition_out
-
-            metadata_raw = raw_segment.get("metadata")
-            metadata_camera = metadata_raw.get("cameraMovement") if isinstance(metadata_raw, dict) else None
-            camera_movement = normalize_camera_movement(
-                raw_segment.get("cameraMovement")
-                or raw_segment.get("camera_movement")
-                or metadata_camera
-            )
-            if camera_movement:
-                segment_plan["cameraMovement"] = camera_movement
+    transition_out = normalize_transition(
+        raw_segment.get("transitionOut")
+        or raw_segment.get("transition_out")
+        or raw_segment.get("exitTransition")
+    )
+    if transition_out:
+        segment_plan["transitionOut"] = transition_out
+
+    metadata_raw = raw_segment.get("metadata")
+    metadata_camera = metadata_raw.get("cameraMovement") if isinstance(metadata_raw, dict) else None
+    camera_movement = normalize_camera_movement(
+        raw_segment.get("cameraMovement")
+        or raw_segment.get("camera_movement")
+        or metadata_camera
+    )
+    if camera_movement:
+        segment_plan["cameraMovement"] = camera_movement
 
-            if isinstance(metadata_raw, dict) and metadata_raw:
-                segment_plan["metadata"] = metadata_raw
+    if isinstance(metadata_raw, dict) and metadata_raw:
+        segment_plan["metadata"] = metadata_raw
 
-            timeline_start = ensure_float(
-                raw_segment.get("timelineStart", raw_segment.get("timeline_start")),
-                source_start,
-            )
-            segment_items.append((timeline_start, segment_plan))
+    timeline_start = ensure_float(
+        raw_segment.get("timelineStart", raw_segment.get("timeline_start")),
+        source_start,
+    )
+    return timeline_start, segment_plan
+
+
+_HIGHLIGHT_ACTION_TYPES = frozenset(
+    {"caption", "highlight", "icon", "notebox", "typewriter", "section", "sectiontitle"}
+)
 
-    segment_items.sort(key=lambda item: (item[0], item[1]["sourceStart"]))
-    normalized_segments = [item[1] for item in segment_items]
 
-    raw_highlights: List[Any] = []
-    if isinstance(plan.get("highlights"), list):
-        raw_highlights = list(plan["highlights"])
-    elif isinstance(plan.get("actions"), list):
-        for action in plan.get("actions", []):
+def _iter_raw_highlights(plan: Dict[str, Any]) -> Iterable[Any]:
+    highlights = plan.get("highlights")
+    if isinstance(highlights, list):
+        yield from highlights
+        return
+    actions = plan.get("actions")
+    if isinstance(actions, list):
+        for action in actions:
             if not isinstance(action, dict):
                 continue
             action_type = (action.get("type") or action.get("kind") or "").lower()
-            if action_type in {"caption", "highlight", "icon", "notebox", "typewriter", "section", "sectiontitle"}:
-                raw_highlights.append(action)
+            if action_type in _HIGHLIGHT_ACTION_TYPES:
+                yield action
 
-    normalized_highlights: List[Dict[str, Any]] = []
-    for idx, raw_highlight in enumerate(raw_highlights):
+
+def _normalized_highlights(plan: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    """Yield normalized highlights lazily; islice at the call site caps the
+    work at MAX_HIGHLIGHTS instead of normalizing the whole list first."""
+    for idx, raw_highlight in enumerate(_iter_raw_highlights(plan)):
         normalized = normalize_highlight_item(raw_highlight, idx)
         if normalized:
-            normalized_highlights.append(normalized)
-        if len(normalized_highlights) >= MAX_HIGHLIGHTS:
-            break
+            yield normalized
+
+
+def normalize_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    if not isinstance(plan, dict):
+        raise ValueError("Plan must be a JSON object.")
 
-    normalized_highlights.sort(key=lambda item: item.get("start", 0.0))
+    # Schwartzian transform: both sort keys are materialized up front so the
+    # comparison runs on plain tuples via C-level itemgetter.
+    segment_items: List[tuple[float, float, Dict[str, Any]]] = []
+    raw_segments = plan.get("segments")
+    if isinstance(raw_segments, list):
+        for index, raw_segment in enumerate(raw_segments):
+            if not isinstance(raw_segment, dict):
+                continue
+            item = normalize_segment_item(raw_segment, index)
+            if item is not None:
+                timeline_start, segment_plan = item
+                segment_items.append((timeline_start, segment_plan["sourceStart"], segment_plan))
+
+    segment_items.sort(key=itemgetter(0, 1))
+    normalized_segments = [item[2] for item in segment_items]
+
+    normalized_highlights = list(islice(_normalized_highlights(plan), MAX_HIGHLIGHTS))
+
+    # normalize_highlight_item always emits "start", so itemgetter is safe.
+    normalized_highlights.sort(key=itemgetter("start"))
+
+    # Tag each highlight with the timeline segment it lands in so renderers
+    # do not re-derive the containment with a linear scan per highlight.
+    if normalized_segments and normalized_highlights:
+        timeline_starts: List[float] = []
+        cursor = 0.0
+        for segment in normalized_segments:
+            timeline_starts.append(cursor)
+            cursor += segment["duration"]
+        for highlight in normalized_highlights:
+            highlight["segmentIndex"] = bisect_right(timeline_starts, highlight["start"]) - 1
 
     normalized_plan: Dict[str, Any] = {
         "segments": normalized_segments,
@@ -709,57 +982,181 @@ def normalize_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
     return normalized_plan
 
 
-def configure_client(model_name: str | None = None) -> genai.GenerativeModel:
+# Tiers for --model auto, smallest adequate model first: prompts under the
+# token bound (len//4 heuristic) go to the cheaper/faster tier.
+_AUTO_MODEL_TIERS = (
+    (8_000, "gemini-1.5-flash-8b"),
+    (32_000, "gemini-1.5-flash"),
+)
+_AUTO_MODEL_LARGE = "gemini-1.5-pro"
+
+
+def pick_model_for_prompt(prompt: str) -> str:
+    estimated_tokens = len(prompt) // 4
+    for bound, name in _AUTO_MODEL_TIERS:
+        if estimated_tokens < bound:
+            return name
+    return _AUTO_MODEL_LARGE
+
+
+@functools.lru_cache(maxsize=1)
+def _genai():
+    # Deferred: pulling in google.generativeai costs hundreds of ms of
+    # grpc/protobuf imports that --help and --dry-run never need.
+    import google.generativeai as genai
+
+    return genai
+
+
+@functools.lru_cache(maxsize=1)
+def _load_env_once() -> None:
+    if os.getenv("GEMINI_API_KEY"):
+        # Already configured via the environment; skip the .env stat walks.
+        return
+
+    from dotenv import load_dotenv
+
     root_dir = Path(__file__).resolve().parents[1]
     load_dotenv(root_dir / ".env")
-    load_dotenv()  # load defaults if present
+    if not os.getenv("GEMINI_API_KEY"):
+        load_dotenv()  # fall back to CWD discovery only when still unset
+
+
+@functools.lru_cache(maxsize=4)
+def _resolve_model_name(model_name: str | None = None) -> str:
+    _load_env_once()
 
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError("Missing GEMINI_API_KEY. Add it to .env or environment variables.")
 
-    genai.configure(api_key=api_key)
-    resolved_model = model_name or os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-    return genai.GenerativeModel(resolved_model)
+    _genai().configure(api_key=api_key)
+    return model_name or os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+
+@functools.lru_cache(maxsize=4)
+def configure_client(model_name: str | None = None) -> genai.GenerativeModel:
+    return _genai().GenerativeModel(_resolve_model_name(model_name))
+
+
+_CACHE_STATE_PATH = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "video-automation" / "gemini_cache.json"
+)
+
+
+def configure_cached_client(model_name: str | None, preamble: str) -> genai.GenerativeModel:
+    """Bind the model to a server-side cache of the static prompt preamble.
+
+    Cache names are persisted keyed by a hash of (model, preamble) so editing
+    the prompt invalidates the entry; expired caches are recreated."""
+    genai = _genai()
+    resolved_model = _resolve_model_name(model_name)
+    digest = hashlib.sha256(f"{resolved_model}\0{preamble}".encode("utf-8")).hexdigest()
+
+    try:
+        state = json.loads(_CACHE_STATE_PATH.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        state = {}
+
+    cache_name = state.get(digest)
+    if cache_name:
+        try:
+            cached = genai.caching.CachedContent.get(cache_name)
+            return genai.GenerativeModel.from_cached_content(cached_content=cached)
+        except Exception:  # noqa: BLE001 - expired/deleted cache; recreate below
+            pass
+
+    cached = genai.caching.CachedContent.create(
+        model=resolved_model,
+        system_instruction=preamble,
+        ttl=datetime.timedelta(hours=1),
+    )
+    state[digest] = cached.name
+    _CACHE_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    _CACHE_STATE_PATH.write_text(json.dumps(state, indent=2) + "\n", encoding="utf-8")
+    return genai.GenerativeModel.from_cached_content(cached_content=cached)
 
 
 def dump_plan(plan: dict, output_path: Path) -> None:
+    if orjson is not None:
+        new_bytes = orjson.dumps(plan, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+    else:
+        new_bytes = (json.dumps(plan, indent=2) + "\n").encode("utf-8")
+    # Leave identical plans untouched so downstream consumers keyed on mtime
+    # (Remotion incremental builds, make-style rules) do not re-run.
+    try:
+        if output_path.read_bytes() == new_bytes:
+            return
+    except OSError:
+        pass
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with output_path.open("w", encoding="utf-8") as handle:
-        json.dump(plan, handle, indent=2)
-        handle.write("\n")
+    output_path.write_bytes(new_bytes)
 
 
-def main(argv: List[str] | None = None) -> int:
-    parser = argparse.ArgumentParser(description="Generate edit plan with Gemini")
-    parser.add_argument("srt_path", type=Path, help="Input SRT transcript")
-    parser.add_argument("output_plan", type=Path, help="Destination JSON plan file")
-    parser.add_argument("--model", dest="model_name", help="Override Gemini model name")
-    parser.add_argument(
-        "--max-entries",
-        type=int,
-        default=160,
-        help="Limit number of SRT entries sent to Gemini",
-    )
-    parser.add_argument(
-        "--extra",
-        dest="extra_instructions",
-        help="Optional free-form instructions appended to the prompt",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="Print the prompt without calling Gemini",
-    )
+# Ask for bare JSON so extract_plan_json takes its direct-loads fast path
+# instead of scanning for fences.
+_JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
 
-    args = parser.parse_args(argv)
+_MAX_GENERATE_ATTEMPTS = 4
+_RETRYABLE_MARKERS = (
+    "429",
+    "500",
+    "503",
+    "rate limit",
+    "resource exhausted",
+    "unavailable",
+    "deadline",
+    "internal error",
+)
+
+
+def _is_retryable_error(exc: Exception) -> bool:
+    # The SDK raises many exception types for quota/server hiccups; match on
+    # the message so we need no import from google.api_core here.
+    text = str(exc).lower()
+    return any(marker in text for marker in _RETRYABLE_MARKERS)
+
+
+async def _generate_text(model, prompt: str, generation_config: dict | None) -> str | None:
+    try:
+        # Stream chunks as they arrive so parsing starts the moment the last
+        # token lands instead of after response assembly.
+        stream = await model.generate_content_async(
+            prompt, stream=True, generation_config=generation_config
+        )
+        chunks: List[str] = []
+        async for chunk in stream:
+            piece = getattr(chunk, "text", None)
+            if piece:
+                chunks.append(piece)
+        return "".join(chunks)
+    except TypeError:
+        # Older SDKs without streaming support on the async client.
+        response = await model.generate_content_async(prompt)
+        return getattr(response, "text", None)
+    except Exception as exc:  # noqa: BLE001 - Gemini client may raise many types
+        # Models predating JSON mode reject response_mime_type; retry plain
+        # and let the fence-scanning extractor cope.
+        if generation_config and "response_mime_type" in str(exc):
+            return await _generate_text(model, prompt, None)
+        raise
+
+
+async def run_job(srt_path: Path, output_plan: Path, args: argparse.Namespace, semaphore: asyncio.Semaphore) -> int:
+    if not srt_path.exists():
+        print(f"[ERROR] SRT file not found: {srt_path}")
+        return 1
 
-    if not args.srt_path.exists():
-        parser.error(f"SRT file not found: {args.srt_path}")
+    if not args.dry_run:
+        # Warm the .env load in a worker thread while the transcript parses;
+        # _load_env_once is cached, so the later resolve finds it done.
+        asyncio.get_running_loop().run_in_executor(None, _load_env_once)
 
-    entries = parse_srt(args.srt_path, max_entries=args.max_entries)
+    entries = parse_srt(srt_path, max_entries=args.max_entries)
     if not entries:
-        parser.error("No valid entries found in SRT")
+        print(f"[ERROR] No valid entries found in SRT: {srt_path}")
+        return 1
+    entries = truncate_to_token_budget(entries, args.token_budget)
 
     prompt = build_prompt(entries, extra_instructions=args.extra_instructions)
 
@@ -767,21 +1164,66 @@ def main(argv: List[str] | None = None) -> int:
         print(prompt)
         return 0
 
+    model_name = args.model_name
+    if model_name == "auto":
+        model_name = pick_model_for_prompt(prompt)
+        print(f"[INFO] --model auto picked {model_name} (~{len(prompt) // 4} prompt tokens)")
+
     try:
-        model = configure_client(args.model_name)
+        resolved_model = _resolve_model_name(model_name)
     except Exception as exc:  # noqa: BLE001 - surface friendly message
         print(f"[ERROR] {exc}")
         return 1
 
+    # Identical (model, prompt) pairs come up constantly while iterating on a
+    # cut; answer those from disk instead of re-spending tokens.
+    cache_path: Path | None = None
+    if not args.no_cache:
+        digest = hashlib.sha256(f"{resolved_model}\0{prompt}".encode("utf-8")).hexdigest()
+        cache_path = args.cache_dir / f"{digest}.json"
+        if cache_path.exists():
+            try:
+                payload = json.loads(cache_path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                payload = None
+            # Entries written before raw text was stored are the plan itself.
+            plan = payload.get("plan", payload) if isinstance(payload, dict) else None
+            if plan is not None:
+                dump_plan(plan, output_plan)
+                print(f"[PLAN] Saved Gemini plan to {output_plan} (response cache hit)")
+                return 0
+
+    model = None
+    if args.cache_context:
+        try:
+            model = configure_cached_client(resolved_model, build_static_preamble())
+            prompt = build_transcript_prompt(entries, extra_instructions=args.extra_instructions)
+        except Exception as exc:  # noqa: BLE001 - caching needs newer models/min tokens
+            print(f"[WARN] Context caching unavailable ({exc}); sending the full prompt")
+
+    if model is None:
+        model = _genai().GenerativeModel(resolved_model)
+
     try:
-        response = model.generate_content(prompt)
+        async with semaphore:
+            for attempt in range(_MAX_GENERATE_ATTEMPTS):
+                try:
+                    raw_text = await _generate_text(model, prompt, _JSON_GENERATION_CONFIG)
+                    break
+                except Exception as exc:  # noqa: BLE001 - Gemini client may raise many types
+                    if attempt == _MAX_GENERATE_ATTEMPTS - 1 or not _is_retryable_error(exc):
+                        raise
+                    # Exponential backoff with jitter so parallel batch jobs
+                    # do not re-slam a rate-limited endpoint in lockstep.
+                    delay = min(30.0, 2.0**attempt) + random.uniform(0.0, 1.0)
+                    print(f"[WARN] Transient Gemini error ({exc}); retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
     except Exception as exc:  # noqa: BLE001 - Gemini client may raise many types
-        print(f"[ERROR] Gemini request failed: {exc}")
+        print(f"[ERROR] Gemini request failed for {srt_path}: {exc}")
         return 1
 
-    raw_text = getattr(response, "text", None)
     if not raw_text:
-        print("[ERROR] Empty response from Gemini")
+        print(f"[ERROR] Empty response from Gemini for {srt_path}")
         return 1
 
     try:
@@ -794,11 +1236,120 @@ def main(argv: List[str] | None = None) -> int:
         print("--- end response ---")
         return 1
 
-    dump_plan(plan, args.output_plan)
-    print(f"[PLAN] Saved Gemini plan to {args.output_plan}")
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        # Raw text is kept alongside the plan so normalization changes can be
+        # replayed against cached responses without new API calls.
+        payload = {"model": resolved_model, "raw": raw_text, "plan": plan}
+        tmp_path.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+
+    dump_plan(plan, output_plan)
+    print(f"[PLAN] Saved Gemini plan to {output_plan}")
     return 0
 
 
+def _load_batch_manifest(manifest_path: Path) -> List[tuple[Path, Path]]:
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    jobs: List[tuple[Path, Path]] = []
+    for item in manifest:
+        if isinstance(item, dict):
+            jobs.append((Path(item["srt"]), Path(item["plan"])))
+        else:
+            srt, plan = item
+            jobs.append((Path(srt), Path(plan)))
+    return jobs
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate edit plan with Gemini")
+    parser.add_argument("srt_path", type=Path, nargs="?", help="Input SRT transcript")
+    parser.add_argument("output_plan", type=Path, nargs="?", help="Destination JSON plan file")
+    parser.add_argument(
+        "--model",
+        dest="model_name",
+        help="Override Gemini model name, or 'auto' to pick a tier from the prompt size",
+    )
+    parser.add_argument(
+        "--max-entries",
+        type=int,
+        default=160,
+        help="Limit number of SRT entries sent to Gemini",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=24000,
+        help="Approximate token budget for the transcript section (0 disables)",
+    )
+    parser.add_argument(
+        "--extra",
+        dest="extra_instructions",
+        help="Optional free-form instructions appended to the prompt",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the prompt without calling Gemini",
+    )
+    parser.add_argument(
+        "--cache-context",
+        action="store_true",
+        help="Cache the static prompt preamble server-side (Gemini context caching)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "video-automation"
+        / "gemini",
+        help="Directory for the local response cache",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the local response cache and always call Gemini",
+    )
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        help="JSON manifest of {srt, plan} pairs processed concurrently",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Max in-flight Gemini calls in --batch mode",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        try:
+            jobs = _load_batch_manifest(args.batch)
+        except (OSError, json.JSONDecodeError, KeyError, ValueError) as exc:
+            parser.error(f"Invalid batch manifest {args.batch}: {exc}")
+        if not jobs:
+            parser.error(f"Batch manifest is empty: {args.batch}")
+    else:
+        if not args.srt_path or not args.output_plan:
+            parser.error("srt_path and output_plan are required unless --batch is given")
+        if not args.srt_path.exists():
+            parser.error(f"SRT file not found: {args.srt_path}")
+        jobs = [(args.srt_path, args.output_plan)]
+
+    async def _run_all() -> List[int]:
+        semaphore = asyncio.Semaphore(max(1, args.concurrency))
+        return await asyncio.gather(
+            *(run_job(srt, plan, args, semaphore) for srt, plan in jobs)
+        )
+
+    # Batch jobs wait on the network concurrently, so N clips finish in
+    # roughly one call's latency instead of N.
+    return max(asyncio.run(_run_all()), default=0)
+
+
 if __name__ == "__main__":
     sys.exit(main())
 